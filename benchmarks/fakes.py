@@ -0,0 +1,194 @@
+import csv
+import json
+import random
+import string
+import hashlib
+import threading
+
+BASE62 = string.digits + string.ascii_letters
+TRACKS_PER_ALBUM = (3,12)
+
+def spotify_id(prefix,index):
+    digits = ''
+    while True:
+        index, remainder = divmod(index,62)
+        digits = BASE62[remainder] + digits
+        if index == 0:
+            break
+    return prefix + digits.rjust(20,'0')
+
+def id_index(id_):
+    index = 0
+    for character in id_[2:]:
+        index = index*62 + BASE62.index(character)
+    return index
+
+def stable_int(*values):
+    return int(hashlib.md5('|'.join(str(value) for value in values).encode('utf-8')).hexdigest()[:12],16)
+
+def month_day(*values):
+    day_of_year = stable_int(*values) % 365
+    for month, days in enumerate((31,28,31,30,31,30,31,31,30,31,30,31),start=1):
+        if day_of_year < days:
+            return month, day_of_year + 1
+        day_of_year -= days
+
+class SyntheticCatalog:
+    def __init__(self,album_count,artist_count=None,seed=0):
+        self.album_count, self.artist_count, self.seed = album_count, artist_count or max(1,album_count//5), seed
+
+    def artist(self,index):
+        return {'id':spotify_id('ar',index),'name':f"Artist {index}",'type':'artist','followers':{'total':stable_int(self.seed,'followers',index) % 1000000},
+                'genres':['rock','pop','jazz','hip hop','folk'][index % 5:index % 5 + 1],'images':[{'url':f"https://i.scdn.co/image/ar{index}"}],'popularity':stable_int(self.seed,'popularity',index) % 100}
+
+    def artist_members(self,index):
+        month, day = month_day(self.seed,'birthday',index)
+        birthday = f"{1930 + stable_int(self.seed,'born',index) % 70}-{month:02d}-{day:02d}"
+        deathday = ''
+        if index % 10 == 0:
+            month, day = month_day(self.seed,'deathday',index)
+            deathday = f"{2000 + stable_int(self.seed,'died',index) % 20}-{month:02d}-{day:02d}"
+        return [[f"Artist {index}",birthday,deathday,'wikipedia']]
+
+    def album_artist_indexes(self,index):
+        artist_indexes = [index % self.artist_count]
+        if index % 7 == 0 and self.artist_count > 1:
+            artist_indexes.append((index // 7) % self.artist_count)
+        return list(dict.fromkeys(artist_indexes))
+
+    def album(self,index,with_tracks=True):
+        month, day = month_day(self.seed,'release',index)
+        album = {'id':spotify_id('al',index),'album_type':['album','single','compilation'][0 if index % 5 else 1 + index % 2],'total_tracks':self.track_count(index),
+                 'images':[{'url':f"https://i.scdn.co/image/al{index}"}],'name':f"Album {index}",'release_date':f"{1950 + stable_int(self.seed,'year',index) % 75}-{month:02d}-{day:02d}",
+                 'release_date_precision':'day','artists':[{'id':spotify_id('ar',artist_index),'name':f"Artist {artist_index}"} for artist_index in self.album_artist_indexes(index)]}
+        if with_tracks:
+            album['tracks'] = {'items':[self.simple_track(index,position) for position in range(album['total_tracks'])]}
+        return album
+
+    def track_count(self,album_index):
+        return TRACKS_PER_ALBUM[0] + album_index % (TRACKS_PER_ALBUM[1] - TRACKS_PER_ALBUM[0])
+
+    def simple_track(self,album_index,position):
+        return {'id':spotify_id('tr',album_index*TRACKS_PER_ALBUM[1] + position),'name':f"Album {album_index} Track {position}",'duration_ms':60000 + stable_int(self.seed,'duration',album_index,position) % 480000,
+                'artists':[{'id':spotify_id('ar',artist_index),'name':f"Artist {artist_index}"} for artist_index in self.album_artist_indexes(album_index)]}
+
+    def track(self,track_index):
+        album_index, position = divmod(track_index,TRACKS_PER_ALBUM[1])
+        track = self.simple_track(album_index,position)
+        track['album'] = self.album(album_index,with_tracks=False)
+        track['popularity'] = stable_int(self.seed,'track_popularity',track_index) % 100
+        return track
+
+    def artist_album_indexes(self,artist_index):
+        return range(artist_index,self.album_count,self.artist_count)
+
+    def write_csvs(self,directory):
+        with open(f"{directory}/albums.csv",'w',encoding='utf-8',newline='') as outfile:
+            writer = csv.writer(outfile,delimiter=',')
+            writer.writerow(['id','album_type','total_tracks'] + [f"image_url_{index}" for index in range(4)] + ['name','release_date','release_date_precision'] + [f"artist_id_{index}" for index in range(60)] + ['added'])
+            for index in range(self.album_count):
+                album = self.album(index,with_tracks=False)
+                artist_ids = [artist['id'] for artist in album['artists']]
+                writer.writerow([album['id'],album['album_type'],album['total_tracks']] + [album['images'][0]['url'],'','',''] + [album['name'],album['release_date'],album['release_date_precision']] + artist_ids + ['']*(60-len(artist_ids)) + ['2024-01-01 00:00:00'])
+        with open(f"{directory}/artists.csv",'w',encoding='utf-8',newline='') as outfile:
+            writer = csv.writer(outfile,delimiter=',')
+            writer.writerow(['id','followers'] + [f"genre_{index}" for index in range(20)] + [f"image_url_{index}" for index in range(5)] + ['name','popularity','band_member_name','birthday','deathday','b_d_day_source','added'])
+            for index in range(self.artist_count):
+                artist = self.artist(index)
+                for member in self.artist_members(index):
+                    writer.writerow([artist['id'],artist['followers']['total']] + (artist['genres'] + ['']*20)[:20] + [artist['images'][0]['url'],'','','',''] + [artist['name'],artist['popularity']] + member + ['2024-01-01 00:00:00'])
+
+class FakeSpotify:
+    def __init__(self,catalog,user_id='benchmark_user',top_artist_count=30,top_track_count=120):
+        self.catalog, self.user_id = catalog, user_id
+        rng = random.Random(f"{catalog.seed}|{user_id}")
+        active_artists = min(catalog.artist_count,5000)
+        self.top_artist_indexes = rng.sample(range(active_artists),min(top_artist_count,active_artists))
+        album_indexes = [album_index for artist_index in self.top_artist_indexes for album_index in list(catalog.artist_album_indexes(artist_index))[:10]]
+        self.top_track_indexes = [album_index*TRACKS_PER_ALBUM[1] + stable_int(user_id,album_index) % catalog.track_count(album_index) for album_index in rng.sample(album_indexes,min(top_track_count,len(album_indexes)))]
+        self.calls, self.lock = {}, threading.Lock()
+
+    def count(self,method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method,0) + 1
+
+    def current_user(self):
+        self.count('current_user')
+        return {'id':self.user_id,'display_name':self.user_id,'country':'US'}
+
+    def current_user_top_tracks(self,limit=20,offset=0,time_range='medium_term'):
+        self.count('current_user_top_tracks')
+        return {'items':[self.catalog.track(track_index) for track_index in self.top_track_indexes[offset:offset+limit]]}
+
+    def current_user_top_artists(self,limit=20,offset=0,time_range='medium_term'):
+        self.count('current_user_top_artists')
+        return {'items':[self.catalog.artist(artist_index) for artist_index in self.top_artist_indexes[offset:offset+limit]]}
+
+    def artist_albums(self,artist_id,include_groups=None,limit=20,offset=0):
+        self.count('artist_albums')
+        album_indexes = list(self.catalog.artist_album_indexes(id_index(artist_id)))
+        return {'items':[self.catalog.album(album_index,with_tracks=False) for album_index in album_indexes[offset:offset+limit]]}
+
+    def albums(self,album_ids):
+        self.count('albums')
+        return {'albums':[self.catalog.album(id_index(album_id)) for album_id in album_ids]}
+
+    def tracks(self,track_ids,market=None):
+        self.count('tracks')
+        return {'tracks':[self.catalog.track(id_index(track_id)) for track_id in track_ids]}
+
+    def artist_top_tracks(self,artist_id,country='US'):
+        self.count('artist_top_tracks')
+        album_indexes = list(self.catalog.artist_album_indexes(id_index(artist_id)))[:10]
+        return {'tracks':[self.catalog.track(album_index*TRACKS_PER_ALBUM[1]) for album_index in album_indexes]}
+
+    def user_playlist_create(self,user,name,public=True,description=''):
+        self.count('user_playlist_create')
+        return {'id':spotify_id('pl',stable_int(user) % 10**9)}
+
+    def playlist_change_details(self,playlist_id,**kwargs):
+        self.count('playlist_change_details')
+
+    def playlist_replace_items(self,playlist_id,items):
+        self.count('playlist_replace_items')
+        return {'snapshot_id':hashlib.md5(''.join(items).encode('utf-8')).hexdigest()}
+
+    def playlist(self,playlist_id):
+        self.count('playlist')
+        return {'id':playlist_id,'snapshot_id':hashlib.md5(playlist_id.encode('utf-8')).hexdigest()}
+
+def recording_key(method,args,kwargs):
+    return json.dumps([method,list(args),kwargs],sort_keys=True)
+
+class RecordingSpotify:
+    def __init__(self,sp,path):
+        self.sp, self.path, self.lock = sp, path, threading.Lock()
+
+    def __getattr__(self,method):
+        def call(*args,**kwargs):
+            response = getattr(self.sp,method)(*args,**kwargs)
+            with self.lock:
+                with open(self.path,'a',encoding='utf-8') as outfile:
+                    outfile.write(json.dumps({'key':recording_key(method,args,kwargs),'response':response}) + '\n')
+            return response
+        return call
+
+class ReplaySpotify:
+    def __init__(self,path,fallback=None):
+        self.responses, self.fallback, self.calls = {}, fallback, {}
+        with open(path,'r',encoding='utf-8') as infile:
+            for line in infile:
+                if line.strip():
+                    recorded = json.loads(line)
+                    self.responses[recorded['key']] = recorded['response']
+
+    def __getattr__(self,method):
+        def call(*args,**kwargs):
+            key = recording_key(method,args,kwargs)
+            self.calls[method] = self.calls.get(method,0) + 1
+            if key in self.responses:
+                return self.responses[key]
+            if self.fallback is None:
+                raise KeyError(f"NO RECORDED RESPONSE | {key}")
+            return getattr(self.fallback,method)(*args,**kwargs)
+        return call
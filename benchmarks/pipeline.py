@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import logging
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0,BENCHMARKS_DIR)
+sys.path.insert(0,REPO_DIR)
+
+from fakes import SyntheticCatalog, FakeSpotify, ReplaySpotify
+from stub_server import start_stub_server
+
+USER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "user" (
+	"id"	INTEGER NOT NULL,
+	"spotify_id"	VARCHAR(100) NOT NULL,
+	"access_token"	VARCHAR(500),
+	"refresh_token"	VARCHAR(500),
+	"token_expiry"	DATETIME,
+	"country"	VARCHAR(100),
+	"display_name"	VARCHAR(300),
+	"email"	VARCHAR(300),
+	"explicit_content"	BOOLEAN,
+	"followers"	INTEGER,
+	"image_url"	VARCHAR(2048),
+	"product"	VARCHAR(20),
+	"music_birthday_spotify_playlist_id"	VARCHAR(100),
+	"music_birthday_spotify_snapshot_ids"	TEXT,
+	PRIMARY KEY("id"),
+	UNIQUE("spotify_id")
+);
+"""
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','HEAD'],cwd=REPO_DIR,capture_output=True,text=True,check=True).stdout.strip()
+    except Exception:
+        return None
+
+def timed(function,repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings), result
+
+def result_row(benchmark,params,timings,items=None,extra=None):
+    row = {'benchmark':benchmark,'params':params,'repeat':len(timings),'min_seconds':timings[0],'median_seconds':timings[len(timings)//2],'max_seconds':timings[-1]}
+    if items:
+        row['items'], row['per_item_us'] = items, timings[0] / items * 1000000
+    if extra:
+        row['extra'] = extra
+    logging.warning(f"{benchmark} | {params} | {round(timings[0],4)}s")
+    return row
+
+def synthetic_candidates(musicbirthday,catalog,candidate_count,seed):
+    rng, tracks_to_consider = random.Random(seed), {}
+    kinds = [musicbirthday.MatchKind.TRACK_ALBUM_RELEASE_DATE,musicbirthday.MatchKind.ARTIST_RELEASE_DATE_TOP_ALBUM,musicbirthday.MatchKind.ARTIST_BIRTHDAY_TOP,musicbirthday.MatchKind.ARTIST_DEATHDAY_TOP,musicbirthday.MatchKind.TRACK_ARTIST_BIRTHDAY_MAIN,musicbirthday.MatchKind.TRACK_ARTIST_DEATHDAY_SUPPORT]
+    for index in range(candidate_count):
+        track = catalog.track(rng.randrange(catalog.album_count*10))
+        kind, id_type = rng.choice(kinds), rng.choice(['track','album','artist'])
+        values = musicbirthday.Match(musicbirthday.match_reason(rng.choice(['short','medium','long']),kind),id_type,rng.randint(1950,2024),track['artists'][0]['name'])
+        tracks_to_consider = musicbirthday.update_tracks_to_consider_with_info(track,values,rng.randint(0,10**8),tracks_to_consider,track['popularity'])
+    return tracks_to_consider
+
+def benchmark_catalog(musicbirthday,args,album_count,results):
+    os.makedirs(f"catalog_{album_count}")
+    os.chdir(f"catalog_{album_count}")
+    catalog = SyntheticCatalog(album_count,seed=args.seed)
+    timings, _ = timed(lambda: catalog.write_csvs('.'),1)
+    results.append(result_row('synthetic_catalog_csv',{'albums':album_count,'artists':catalog.artist_count},timings,album_count))
+    conn = sqlite3.connect('musicbirthday.db')
+    timings, musicbirthday_index = timed(lambda: musicbirthday.load_musicbirthday_index(conn),1)
+    results.append(result_row('catalog_import',{'albums':album_count,'artists':catalog.artist_count},timings,album_count))
+    timings, (musicbirthday_values, _, _) = timed(lambda: musicbirthday.cached_musicbirthday_values(conn,musicbirthday_index,args.month,args.day),args.repeat)
+    results.append(result_row('cached_musicbirthday_values',{'albums':album_count,'artists':catalog.artist_count},timings,None,{key:len(value) for key, value in musicbirthday_values.items()}))
+    timings, _ = timed(lambda: musicbirthday.build_catalog_snapshot(conn),1)
+    results.append(result_row('catalog_snapshot_build',{'albums':album_count,'artists':catalog.artist_count},timings,album_count,{'bytes':os.path.getsize(musicbirthday.CATALOG_SNAPSHOT_FILE)}))
+    timings, snapshot_index = timed(lambda: musicbirthday.load_musicbirthday_index(conn),args.repeat)
+    results.append(result_row('catalog_snapshot_open',{'albums':album_count,'artists':catalog.artist_count},timings,album_count))
+    timings, (snapshot_values, _, _) = timed(lambda: musicbirthday.cached_musicbirthday_values(conn,snapshot_index,args.month,args.day),args.repeat)
+    results.append(result_row('cached_musicbirthday_values_snapshot',{'albums':album_count,'artists':catalog.artist_count},timings,None,{key:len(value) for key, value in snapshot_values.items()}))
+    albums = [catalog.album(index,with_tracks=False) for index in range(min(album_count,args.special_albums))]
+    def match_albums():
+        values, ids_related_to_user_for_today = {key:dict(value) for key, value in musicbirthday_values.items()}, {}
+        for album in albums:
+            ids_related_to_user_for_today = musicbirthday.check_if_track_or_album_is_special(None,album,values,ids_related_to_user_for_today,'short',musicbirthday.MOST_RECENT_YEAR,args.month,args.day,musicbirthday.SKIP_KEYWORDS)
+        return ids_related_to_user_for_today
+    timings, matched = timed(match_albums,args.repeat)
+    results.append(result_row('check_if_track_or_album_is_special',{'albums':album_count,'rows':len(albums)},timings,len(albums),{'matched':len(matched)}))
+    conn.close()
+    os.chdir('..')
+    return catalog
+
+def benchmark_scoring(musicbirthday,args,catalog,results):
+    for candidate_count in args.candidates:
+        tracks_to_consider = synthetic_candidates(musicbirthday,catalog,candidate_count,args.seed)
+        timings, tracks_to_consider = timed(lambda: musicbirthday.get_track_scores(tracks_to_consider),args.repeat)
+        results.append(result_row('get_track_scores',{'candidates':candidate_count},timings,candidate_count))
+        timings, (track_ids, _) = timed(lambda: musicbirthday.get_track_ids_to_add_to_playlist(tracks_to_consider,seed=args.seed),args.repeat)
+        results.append(result_row('get_track_ids_to_add_to_playlist',{'candidates':candidate_count},timings,candidate_count,{'playlist_length':len(track_ids)}))
+
+def prepare_end_to_end(musicbirthday,args,catalog,results):
+    os.makedirs('end_to_end')
+    shutil.copy(f"catalog_{catalog.album_count}/musicbirthday.db",'end_to_end/musicbirthday.db')
+    shutil.copy(f"catalog_{catalog.album_count}/{musicbirthday.CATALOG_SNAPSHOT_FILE}",f"end_to_end/{musicbirthday.CATALOG_SNAPSHOT_FILE}")
+    os.chdir('end_to_end')
+    musicbirthday.spotify_catalog_object = lambda: FakeSpotify(catalog,'catalog')
+    conn = sqlite3.connect('musicbirthday.db',timeout=30)
+    conn.executescript(USER_SCHEMA)
+    engine = musicbirthday.PlaylistEngine(seed=args.seed).load_index(conn)
+    today = datetime.today().date().replace(month=args.month,day=args.day)
+    timings, day_state = timed(lambda: engine.load_candidate_pool(conn,today),1)
+    results.append(result_row('daily_candidate_pool',{'albums':catalog.album_count},timings,None,{'tracks':len(day_state['daily_candidate_pool']['tracks'])}))
+    musicbirthday.start_enrichment_workers(args.enrichment_workers)
+    return conn, engine, today
+
+def reset_caches(musicbirthday,conn):
+    musicbirthday.spotify_cache_memory.clear()
+    conn.executescript(musicbirthday.ARTIST_SCANS_SCHEMA)
+    with conn:
+        conn.execute("DELETE FROM artist_scans")
+    with sqlite3.connect(musicbirthday.HTTP_CACHE_FILE) as http_cache_conn:
+        http_cache_conn.executescript(musicbirthday.HTTP_CACHE_SCHEMA)
+        http_cache_conn.execute("DELETE FROM http_cache")
+    return musicbirthday.load_artist_scans(conn)
+
+def benchmark_end_to_end(musicbirthday,args,catalog,user_count,end_to_end,results):
+    conn, engine, today = end_to_end
+    spotify_clients = {}
+    def spotify_for(user_id):
+        fake_spotify = FakeSpotify(catalog,user_id)
+        spotify_clients[user_id] = ReplaySpotify(args.replay,fallback=fake_spotify) if args.replay else fake_spotify
+        return spotify_clients[user_id]
+    engine.token_manager.client = lambda spotify_id, refresh_token: spotify_for(refresh_token)
+    engine.artists_scanned_this_run = reset_caches(musicbirthday,conn)
+    user_ids = [f"user_{user_count}_{index}" for index in range(user_count)]
+    with conn:
+        conn.executemany("INSERT INTO user (spotify_id,refresh_token,email) VALUES (?,?,?)",((user_id,user_id,f"{user_id}@example.com") for user_id in user_ids))
+    user_rows = conn.execute(f"SELECT spotify_id,refresh_token,email,music_birthday_spotify_playlist_id FROM user WHERE spotify_id IN ({','.join('?'*len(user_ids))})",user_ids).fetchall()
+    musicbirthday.start_run_metrics()
+    def run_users():
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for user_row in user_rows:
+                executor.submit(engine.generate,user_row,True,today)
+    timings, _ = timed(run_users,1)
+    spotify_calls = {}
+    for spotify_client in spotify_clients.values():
+        for method, count in spotify_client.calls.items():
+            spotify_calls[method] = spotify_calls.get(method,0) + count
+    metrics = {name:{'count':count,'seconds':seconds} for name, (count,seconds) in musicbirthday.run_metrics['metrics'].items()}
+    playlists = conn.execute(f"SELECT count(*) FROM user WHERE music_birthday_spotify_playlist_id IS NOT NULL AND spotify_id IN ({','.join('?'*len(user_ids))})",user_ids).fetchone()[0]
+    results.append(result_row('end_to_end',{'users':user_count,'workers':args.workers,'albums':catalog.album_count,'stub_latency_ms':args.stub_latency_ms},timings,user_count,
+                              {'playlists_written':playlists,'spotify_calls':spotify_calls,'metrics':metrics}))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--albums",type=int_list, help="Synthetic catalog sizes, comma separated (default = 10000,100000)",default=[10000,100000])
+    parser.add_argument("--candidates",type=int_list, help="Candidate counts for scoring and selection (default = 1000,10000)",default=[1000,10000])
+    parser.add_argument("--users",type=int_list, help="User counts for the end-to-end run (default = 1,4,16)",default=[1,4,16])
+    parser.add_argument("--workers",type=int, help="Users updated at the same time in the end-to-end run (default = 4)",default=4)
+    parser.add_argument("--enrichment-workers",type=int, help="Background enrichment workers (default = 2)",default=2)
+    parser.add_argument("--special-albums",type=int, help="Album rows fed to check_if_track_or_album_is_special (default = 20000)",default=20000)
+    parser.add_argument("--repeat",type=int, help="Repetitions for the micro-benchmarks, the minimum is reported (default = 3)",default=3)
+    parser.add_argument("--month",type=int, help="Month to match (default = 10)",default=10)
+    parser.add_argument("--day",type=int, help="Day to match (default = 18)",default=18)
+    parser.add_argument("--seed",type=int, help="Seed for the synthetic data (default = 0)",default=0)
+    parser.add_argument("--stub-latency-ms",type=int, help="Latency added to every stub HTTP response (default = 0)",default=0)
+    parser.add_argument("--replay",type=str, help="JSON lines of recorded Spotify responses to replay before falling back to the synthetic catalog",default=None)
+    parser.add_argument("--real-rate-limits",action='store_true', help="Keep the production API rate limits")
+    parser.add_argument("--output",type=str, help="Write results JSON here instead of stdout",default=None)
+    parser.add_argument("--keep",action='store_true', help="Keep the temporary working directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING,format='%(asctime)s | %(levelname)s | %(message)s')
+    stub_servers = {}
+    for upstream in ('LASTFM','MUSICBRAINZ','WIKIPEDIA','FAMOUSBIRTHDAYS'):
+        stub_servers[upstream], os.environ[f"MB_{upstream}_URL"] = start_stub_server(args.stub_latency_ms)
+    import musicbirthday
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.real_rate_limits:
+        for upstream in musicbirthday.API_RATE_LIMITS:
+            musicbirthday.RATE_LIMITERS[upstream] = musicbirthday.TokenBucket(10**9,10**9)
+    output_path = os.path.abspath(args.output) if args.output else None
+    working_dir = tempfile.mkdtemp(prefix='musicbirthday_benchmark_')
+    os.chdir(working_dir)
+    results, started_at = [], datetime.now().isoformat(timespec='seconds')
+    try:
+        catalogs = [benchmark_catalog(musicbirthday,args,album_count,results) for album_count in args.albums]
+        benchmark_scoring(musicbirthday,args,catalogs[0],results)
+        end_to_end = prepare_end_to_end(musicbirthday,args,catalogs[0],results)
+        for user_count in args.users:
+            benchmark_end_to_end(musicbirthday,args,catalogs[0],user_count,end_to_end,results)
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(working_dir,ignore_errors=True)
+    report = {'commit':git_commit(),'started_at':started_at,'python':platform.python_version(),'platform':platform.platform(),'args':vars(args),'results':results}
+    if output_path:
+        with open(output_path,'w',encoding='utf-8') as outfile:
+            json.dump(report,outfile,indent=2)
+    else:
+        print(json.dumps(report,indent=2))
@@ -0,0 +1,67 @@
+import os
+import glob
+import json
+import time
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fakes import stable_int, month_day
+
+WIKIPEDIA_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','wikipedia')
+WIKIPEDIA_PAGE = """<html><head><title>{name} - Wikipedia</title></head><body><div class="mw-parser-output">
+<table class="infobox biography vcard"><tbody><tr><th colspan="2" class="infobox-above">{name}</th></tr>
+<tr><th scope="row" class="infobox-label">Born</th><td class="infobox-data"><span style="display:none"> (<span class="bday">{birthday}</span>) </span></td></tr>
+</tbody></table><p>{name} is a musician.</p>{filler}</div></body></html>"""
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency_seconds = 0
+    wikipedia_fixtures = {}
+
+    def log_message(self,format,*args):
+        pass
+
+    def reply(self,status,body,content_type='application/json'):
+        if isinstance(body,(dict,list)):
+            body = json.dumps(body)
+        body = body.encode('utf-8') if isinstance(body,str) else body
+        self.send_response(status)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/2.0/':
+            artist, track = query.get('artist',[''])[0], query.get('track',[''])[0]
+            return self.reply(200,{'track':{'name':track,'artist':{'name':artist},'playcount':str(stable_int('playcount',artist,track) % 50000000)}})
+        if url.path.startswith('/ws/2/artist/'):
+            artist_id = url.path[len('/ws/2/artist/'):].strip('/')
+            if not artist_id:
+                name = query.get('query',['artist:'])[0].split(':',1)[-1]
+                return self.reply(200,{'artists':[{'id':f"mb{stable_int('mbid',name) % 10**12}",'name':name}]})
+            month, day = month_day('mb',artist_id)
+            return self.reply(200,{'id':artist_id,'type':'Person','name':artist_id,'life-span':{'begin':f"{1930 + stable_int('mb_year',artist_id) % 70}-{month:02d}-{day:02d}",'end':''}})
+        if url.path.startswith('/wiki/'):
+            name = unquote(url.path[len('/wiki/'):])
+            if name in self.wikipedia_fixtures:
+                return self.reply(200,self.wikipedia_fixtures[name],'text/html; charset=UTF-8')
+            if '_(' in name:
+                return self.reply(404,'Not Found','text/html')
+            month, day = month_day('wikipedia',name)
+            return self.reply(200,WIKIPEDIA_PAGE.format(name=name,birthday=f"{1930 + stable_int('wikipedia_year',name) % 70}-{month:02d}-{day:02d}",filler='<p>lorem ipsum</p>'*2000),'text/html; charset=UTF-8')
+        return self.reply(404,'Not Found','text/html')
+
+def start_stub_server(latency_ms=0):
+    StubHandler.latency_seconds = latency_ms / 1000
+    for path in glob.glob(os.path.join(WIKIPEDIA_FIXTURES_DIR,'*.html')):
+        with open(path,'rb') as infile:
+            StubHandler.wikipedia_fixtures[os.path.splitext(os.path.basename(path))[0]] = infile.read()
+    server = ThreadingHTTPServer(('127.0.0.1',0),StubHandler)
+    threading.Thread(target=server.serve_forever,name='stub_server',daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,80 @@
+import os
+import sys
+import glob
+import time
+import zlib
+import sqlite3
+import argparse
+import tracemalloc
+import hashlib
+from bs4 import BeautifulSoup
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import musicbirthday
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','wikipedia')
+
+def soup_text(soup_object,label):
+    try:
+        return soup_object.find('th', string=label).find_next_sibling('td').get_text(strip=True)
+    except Exception:
+        return ''
+
+def soup_fields(page):
+    soup_object = BeautifulSoup(page,'html.parser')
+    bday = soup_object.find('span',{'class':'bday'})
+    try:
+        died = soup_object.find('th', string="Died").find_next_sibling('td').find('span').get_text(strip=True).replace('(','').replace(')','')
+    except Exception:
+        died = ''
+    try:
+        nickname = soup_object.find('th', string="Born").find_next_sibling('td').find('div', {'class':'nickname'}).get_text(strip=True)
+    except Exception:
+        nickname = ''
+    return {'bday':bday.get_text(strip=True) if bday else '','died':died,'birth_name':soup_text(soup_object,"Birth name"),'nickname':nickname,'also_known_as':soup_text(soup_object,"Also known as")}
+
+def time_extraction(extract,page,iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        extract(page)
+    elapsed = (time.perf_counter() - started) / iterations
+    tracemalloc.start()
+    extract(page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def save_cached_pages(http_cache_file):
+    conn = sqlite3.connect(http_cache_file)
+    saved = 0
+    for url, body in conn.execute("SELECT url,body FROM http_cache WHERE status = 200 AND url LIKE ?",(musicbirthday.HTTP_BASE_URLS['wikipedia']+'/wiki/%',)):
+        with open(os.path.join(FIXTURES_DIR,hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]+'.html'),'wb') as outfile:
+            outfile.write(zlib.decompress(body))
+        saved += 1
+    print(f"Saved {saved} cached Wikipedia pages to {FIXTURES_DIR}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n",type=int, help="Iterations per page (default = 20)",default=20)
+    parser.add_argument("--from-cache",type=str, help="Copy cached Wikipedia pages from this http cache database into the fixtures first",default=None)
+    args = parser.parse_args()
+    if args.from_cache:
+        save_cached_pages(args.from_cache)
+    totals = {'soup':[0,0],'infobox':[0,0]}
+    mismatches = 0
+    print(f"{'page':<24}{'KB':>8}{'soup ms':>10}{'infobox ms':>12}{'soup KB':>10}{'infobox KB':>12}")
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR,'*.html'))):
+        with open(path,'rb') as infile:
+            page = infile.read()
+        if soup_fields(page) != musicbirthday.wikipedia_infobox_fields(page):
+            mismatches += 1
+            print(f"MISMATCH | {path} | {soup_fields(page)} | {musicbirthday.wikipedia_infobox_fields(page)}")
+        soup_seconds, soup_peak = time_extraction(soup_fields,page,args.n)
+        infobox_seconds, infobox_peak = time_extraction(musicbirthday.wikipedia_infobox_fields,page,args.n)
+        for name, seconds, peak in (('soup',soup_seconds,soup_peak),('infobox',infobox_seconds,infobox_peak)):
+            totals[name][0] += seconds
+            totals[name][1] += peak
+        print(f"{os.path.basename(path)[:23]:<24}{len(page)/1024:>8.0f}{soup_seconds*1000:>10.2f}{infobox_seconds*1000:>12.2f}{soup_peak/1024:>10.0f}{infobox_peak/1024:>12.0f}")
+    print(f"{'total':<24}{'':>8}{totals['soup'][0]*1000:>10.2f}{totals['infobox'][0]*1000:>12.2f}{totals['soup'][1]/1024:>10.0f}{totals['infobox'][1]/1024:>12.0f}")
+    print(f"speedup {totals['soup'][0]/max(totals['infobox'][0],1e-9):.1f}x | memory {totals['soup'][1]/max(totals['infobox'][1],1):.1f}x | {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
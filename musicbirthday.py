@@ -2,9 +2,10 @@ import csv
 import sqlite3
 import logging
 import spotipy
-import requests
+import httpx
+import asyncio
 from bs4 import BeautifulSoup
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from datetime import datetime, timedelta
 import time
 import argparse
@@ -12,9 +13,30 @@ import sys
 import random
 import smtplib
 import os
+import json
+import zlib
+import hashlib
+import threading
+import bisect
+import heapq
+import mmap
+import struct
+import cProfile
+import pstats
+import tracemalloc
+import re
+import numpy as np
+import lxml.html
+from collections import OrderedDict
+from contextlib import contextmanager
+from enum import IntEnum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from urllib.parse import quote
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlparse
+from zoneinfo import ZoneInfo
 from tqdm import tqdm
 
 SPOTIPY_001_CLIENT_ID = os.getenv('SPOTIPY_001_CLIENT_ID')
@@ -23,26 +45,582 @@ SPOTIPY_001_REDIRECT_URI = 'https://musicbirthday.com/callback'
 SPOTIPY_001_SCOPE = 'user-top-read playlist-modify-public user-read-private'
 
 MAX_PLAYLIST_LENGTH = 50
+PLAYLIST_SHUFFLE_SEED = None
 SPOTIFY_GET_LIMIT = 50
 MOST_RECENT_YEAR = 2022
 SLEEP_TIMER = 0.4
+CATALOG_BATCH_SIZE = 500
+PLAYCOUNT_TTL_DAYS = 30
+PLAYCOUNT_FETCH_WORKERS = 5
+SPOTIFY_FETCH_WORKERS = 4
+HTTP_CACHE_FILE = 'http_cache.db'
+CATALOG_SNAPSHOT_FILE = 'musicbirthday.snapshot'
+CATALOG_SNAPSHOT_MAGIC = b'MBSNAP01'
+HTTP_CACHE_TTL_DAYS = {'default':30,'wikipedia':90,'musicbrainz':30,'famousbirthdays':90}
+HTTP_CACHE_NEGATIVE_TTL_DAYS = 3
+HTTP_CACHE_NEGATIVE_STATUSES = {404,410}
+SPOTIFY_CACHE_TTL_HOURS = {'artist_albums':72,'artist_top_tracks':24,'album':24*30,'track':24*7}
+SPOTIFY_CACHE_MEMORY_ENTRIES = 20000
+ENRICHMENT_MAX_ATTEMPTS = 5
+ENRICHMENT_CLAIM_TIMEOUT_SECONDS = 30*60
+ARTIST_SCAN_TTL_DAYS = 3
+ARTIST_SCAN_FLUSH_SIZE = 100
+PROFILE_TOP_N = 40
+USER_TOP_SNAPSHOT_MAX_AGE_HOURS = {'short':20,'medium':24*7,'long':24*30}
+SCHEDULE_MODE = 'local-midnight'
+SCHEDULE_WINDOW_HOURS = 6
+SCHEDULE_RUN_TIME = (0,1)
+SIGNUP_CHECK_SECONDS = 30
+TOKEN_REFRESH_MARGIN_SECONDS = 10*60
+TOKEN_REFRESH_WORKERS = 4
+SPOTIFY_USER_CLIENTS = 64
+MATCH_DAYS_BEFORE = 1
+MATCH_DAYS_AFTER = 1
+ALBUM_ARTIST_MATCH_LIMIT = 60
+COUNTRY_TIMEZONES = {
+    'US':'America/Chicago','CA':'America/Toronto','MX':'America/Mexico_City','BR':'America/Sao_Paulo','AR':'America/Argentina/Buenos_Aires','CL':'America/Santiago','CO':'America/Bogota',
+    'GB':'Europe/London','IE':'Europe/Dublin','PT':'Europe/Lisbon','ES':'Europe/Madrid','FR':'Europe/Paris','BE':'Europe/Brussels','NL':'Europe/Amsterdam','DE':'Europe/Berlin',
+    'CH':'Europe/Zurich','AT':'Europe/Vienna','IT':'Europe/Rome','DK':'Europe/Copenhagen','NO':'Europe/Oslo','SE':'Europe/Stockholm','FI':'Europe/Helsinki','PL':'Europe/Warsaw',
+    'CZ':'Europe/Prague','GR':'Europe/Athens','TR':'Europe/Istanbul','IL':'Asia/Jerusalem','ZA':'Africa/Johannesburg','NG':'Africa/Lagos','EG':'Africa/Cairo','IN':'Asia/Kolkata',
+    'SG':'Asia/Singapore','PH':'Asia/Manila','ID':'Asia/Jakarta','JP':'Asia/Tokyo','KR':'Asia/Seoul','TW':'Asia/Taipei','HK':'Asia/Hong_Kong','AU':'Australia/Sydney','NZ':'Pacific/Auckland',
+}
+HTTP_BASE_URLS = {
+    'lastfm':os.getenv('MB_LASTFM_URL','http://ws.audioscrobbler.com'),
+    'musicbrainz':os.getenv('MB_MUSICBRAINZ_URL','https://musicbrainz.org'),
+    'wikipedia':os.getenv('MB_WIKIPEDIA_URL','https://en.wikipedia.org'),
+    'famousbirthdays':os.getenv('MB_FAMOUSBIRTHDAYS_URL','https://www.famousbirthdays.com'),
+}
+HTTP_USER_AGENT = 'MusicBirthday/1.0 ( support@musicbirthday.com )'
+HTTP_TIMEOUT_SECONDS = 4
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_SECONDS = 1.0
+HTTP_MAX_RETRY_AFTER_SECONDS = 60
+HTTP_RETRY_STATUSES = {429,500,502,503,504}
+HTTP_HOST_CONCURRENCY = {'default':4,'lastfm':PLAYCOUNT_FETCH_WORKERS,'musicbrainz':1,'wikipedia':8,'famousbirthdays':2}
 
 LAST_FM_API_KEY = os.getenv('LAST_FM_API_KEY')
 LAST_FM_API_SECRET = os.getenv('LAST_FM_API_SECRET')
 SKIP_KEYWORDS = {}
 SKIP_YEARS_DUE_TO_BEING_TOO_RECENT = {'2025','2024','2023','2022','2021',}
+SCORING_WEIGHTS = {
+    'min_duration_ms':90000,
+    'max_duration_ms':600000,
+    'skip_recent_years':False,
+    'id_type':{'track':6,'artist':3,'artist_album':3},
+    'time_range':{'short':5,'medium':3,'long':1},
+    'year_bucket_size':5,
+    'playcount_thresholds':[1000,10000,50000,100000,250000,500000,1000000,2000000,3000000,4000000,5000000,10000000,25000000,50000000,100000000,1000000000,999999999999],
+    'playcount_divisor':1.2,
+}
 
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.getenv('MB_SMTP_SERVER',"smtp.gmail.com")
+SMTP_PORT = int(os.getenv('MB_SMTP_PORT',587))
+SMTP_STARTTLS = os.getenv('MB_SMTP_STARTTLS','y') == 'y'
+SMTP_FROM = "Music Birthday <support@musicbirthday.com>"
+SMTP_TIMEOUT_SECONDS = 30
+SMTP_IDLE_SECONDS = 60
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_BACKOFF_SECONDS = 60
+EMAIL_DRAIN_SECONDS = 120
+EMAIL_CLAIM_TIMEOUT_SECONDS = 10*60
 SMTP_USERNAME = os.getenv('MB_SMTP_UN')
 SMTP_PASSWORD = os.getenv('MB_SMTP_PW')
 
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+	id VARCHAR(100) NOT NULL, 
+	album_type VARCHAR(20), 
+	total_tracks INTEGER, 
+	name TEXT, 
+	release_date VARCHAR(20), 
+	release_date_precision VARCHAR(10), 
+	release_year INTEGER, 
+	release_month INTEGER, 
+	release_day INTEGER, 
+	added DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_albums_release_month_day ON albums (release_month, release_day);
+CREATE TABLE IF NOT EXISTS album_artists (
+	album_id VARCHAR(100) NOT NULL, 
+	position INTEGER NOT NULL, 
+	artist_id VARCHAR(100) NOT NULL, 
+	PRIMARY KEY (album_id, position)
+);
+CREATE INDEX IF NOT EXISTS ix_album_artists_artist_id ON album_artists (artist_id);
+CREATE TABLE IF NOT EXISTS artists (
+	id VARCHAR(100) NOT NULL, 
+	name TEXT, 
+	followers INTEGER, 
+	popularity INTEGER, 
+	added DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE IF NOT EXISTS artist_members (
+	artist_id VARCHAR(100) NOT NULL, 
+	position INTEGER NOT NULL, 
+	band_member_name TEXT, 
+	birthday VARCHAR(20), 
+	birthday_year INTEGER, 
+	birthday_month INTEGER, 
+	birthday_day INTEGER, 
+	deathday VARCHAR(20), 
+	deathday_year INTEGER, 
+	deathday_month INTEGER, 
+	deathday_day INTEGER, 
+	b_d_day_source VARCHAR(50), 
+	PRIMARY KEY (artist_id, position)
+);
+CREATE INDEX IF NOT EXISTS ix_artist_members_birthday_month_day ON artist_members (birthday_month, birthday_day);
+CREATE INDEX IF NOT EXISTS ix_artist_members_deathday_month_day ON artist_members (deathday_month, deathday_day);
+CREATE TABLE IF NOT EXISTS artist_genres (
+	artist_id VARCHAR(100) NOT NULL, 
+	position INTEGER NOT NULL, 
+	genre VARCHAR(100) NOT NULL, 
+	PRIMARY KEY (artist_id, position)
+);
+CREATE TABLE IF NOT EXISTS images (
+	owner_id VARCHAR(100) NOT NULL, 
+	position INTEGER NOT NULL, 
+	owner_type VARCHAR(10) NOT NULL, 
+	url VARCHAR(2048) NOT NULL, 
+	PRIMARY KEY (owner_id, position)
+);
+"""
+
+CATALOG_CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_changes (
+	seq INTEGER PRIMARY KEY AUTOINCREMENT, 
+	kind VARCHAR(10) NOT NULL, 
+	id VARCHAR(100) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog_snapshot_builds (
+	seq INTEGER NOT NULL, 
+	built_at INTEGER NOT NULL, 
+	pruned_through INTEGER NOT NULL, 
+	PRIMARY KEY (seq)
+);
+"""
+
+CATALOG_CHANGES_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS tr_albums_insert AFTER INSERT ON albums
+BEGIN
+	INSERT INTO catalog_changes (kind,id) VALUES ('album',NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS tr_albums_update AFTER UPDATE ON albums
+BEGIN
+	INSERT INTO catalog_changes (kind,id) VALUES ('album',NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS tr_album_artists_insert AFTER INSERT ON album_artists
+BEGIN
+	INSERT INTO catalog_changes (kind,id) VALUES ('album',NEW.album_id);
+END;
+CREATE TRIGGER IF NOT EXISTS tr_artists_insert AFTER INSERT ON artists
+BEGIN
+	INSERT INTO catalog_changes (kind,id) VALUES ('artist',NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS tr_artist_members_insert AFTER INSERT ON artist_members
+BEGIN
+	INSERT INTO catalog_changes (kind,id) VALUES ('artist',NEW.artist_id);
+END;
+"""
+
+PLAYCOUNT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_playcounts (
+	track_id VARCHAR(100) NOT NULL, 
+	playcount INTEGER NOT NULL, 
+	fetched_at INTEGER NOT NULL, 
+	PRIMARY KEY (track_id)
+) WITHOUT ROWID;
+"""
+
+HTTP_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+	key CHAR(64) NOT NULL, 
+	url TEXT NOT NULL, 
+	status INTEGER NOT NULL, 
+	body BLOB, 
+	fetched_at INTEGER NOT NULL, 
+	expires_at INTEGER NOT NULL, 
+	PRIMARY KEY (key)
+);
+CREATE TABLE IF NOT EXISTS spotify_cache (
+	endpoint VARCHAR(30) NOT NULL, 
+	key VARCHAR(200) NOT NULL, 
+	body BLOB NOT NULL, 
+	expires_at INTEGER NOT NULL, 
+	PRIMARY KEY (endpoint, key)
+);
+"""
+
+ENRICHMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrichment_queue (
+	artist_id VARCHAR(100) NOT NULL, 
+	artist_json TEXT NOT NULL, 
+	status VARCHAR(20) NOT NULL, 
+	attempts INTEGER NOT NULL, 
+	last_error TEXT, 
+	enqueued_at DATETIME NOT NULL, 
+	PRIMARY KEY (artist_id)
+);
+CREATE INDEX IF NOT EXISTS ix_enrichment_queue_status ON enrichment_queue (status, enqueued_at);
+"""
+
+CANDIDATE_POOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_candidates (
+	day DATE NOT NULL, 
+	source_id VARCHAR(100) NOT NULL, 
+	track_id VARCHAR(100) NOT NULL, 
+	id_type VARCHAR(10) NOT NULL, 
+	reason VARCHAR(20) NOT NULL, 
+	year INTEGER, 
+	band_member TEXT, 
+	playcount INTEGER NOT NULL, 
+	popularity INTEGER NOT NULL, 
+	duration_ms INTEGER NOT NULL, 
+	track_json TEXT NOT NULL, 
+	PRIMARY KEY (day, source_id, track_id)
+);
+"""
+
+ARTIST_SCANS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artist_scans (
+	artist_id VARCHAR(100) NOT NULL, 
+	scanned_at INTEGER NOT NULL, 
+	PRIMARY KEY (artist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_artist_scans_scanned_at ON artist_scans (scanned_at);
+"""
+
+USER_TOP_SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_top_snapshot (
+	spotify_id VARCHAR(100) NOT NULL, 
+	time_range VARCHAR(10) NOT NULL, 
+	item_type VARCHAR(10) NOT NULL, 
+	position INTEGER NOT NULL, 
+	item_id VARCHAR(100) NOT NULL, 
+	item_json TEXT NOT NULL, 
+	fetched_at INTEGER NOT NULL, 
+	PRIMARY KEY (spotify_id, time_range, item_type, position)
+) WITHOUT ROWID;
+"""
+
+SCHEDULE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_schedule (
+	spotify_id VARCHAR(100) NOT NULL, 
+	next_run_at INTEGER NOT NULL, 
+	last_run_at INTEGER, 
+	PRIMARY KEY (spotify_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS signup_queue (
+	id INTEGER NOT NULL, 
+	spotify_id VARCHAR(100) NOT NULL, 
+	enqueued_at INTEGER NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE TRIGGER IF NOT EXISTS tr_user_signup AFTER INSERT ON user
+BEGIN
+	INSERT INTO signup_queue (spotify_id,enqueued_at) VALUES (NEW.spotify_id,CAST(strftime('%s','now') AS INTEGER));
+END;
+"""
+
+EMAIL_OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+	id INTEGER NOT NULL, 
+	recipient VARCHAR(300) NOT NULL, 
+	message TEXT NOT NULL, 
+	status VARCHAR(20) NOT NULL, 
+	attempts INTEGER NOT NULL, 
+	last_error TEXT, 
+	next_attempt_at INTEGER NOT NULL, 
+	enqueued_at INTEGER NOT NULL, 
+	sent_at INTEGER, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_email_outbox_status ON email_outbox (status, next_attempt_at);
+"""
+
+PLAYLIST_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlist_history (
+	id INTEGER NOT NULL, 
+	spotify_id VARCHAR(100) NOT NULL, 
+	playlist_id VARCHAR(100) NOT NULL, 
+	day DATE, 
+	name TEXT, 
+	description TEXT, 
+	track_ids TEXT, 
+	reasons TEXT, 
+	snapshot_id VARCHAR(100), 
+	details_changed BOOLEAN NOT NULL, 
+	tracks_changed BOOLEAN NOT NULL, 
+	published_at INTEGER NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_playlist_history_user ON playlist_history (spotify_id, playlist_id, id);
+"""
+
+METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+	run_id VARCHAR(40) NOT NULL, 
+	scope VARCHAR(10) NOT NULL, 
+	subject VARCHAR(100) NOT NULL, 
+	name VARCHAR(100) NOT NULL, 
+	count INTEGER NOT NULL, 
+	seconds REAL NOT NULL, 
+	recorded_at INTEGER NOT NULL, 
+	PRIMARY KEY (run_id, scope, subject, name)
+);
+"""
+
+CATALOG_UPSERTS = {
+    'albums':"""INSERT INTO albums (id,album_type,total_tracks,name,release_date,release_date_precision,release_year,release_month,release_day,added) VALUES (?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(id) DO UPDATE SET album_type = excluded.album_type,total_tracks = excluded.total_tracks,name = excluded.name,release_date = excluded.release_date,
+    release_date_precision = excluded.release_date_precision,release_year = excluded.release_year,release_month = excluded.release_month,release_day = excluded.release_day""",
+    'album_artists':"""INSERT OR REPLACE INTO album_artists (album_id,position,artist_id) VALUES (?,?,?)""",
+    'artists':"""INSERT INTO artists (id,name,followers,popularity,added) VALUES (?,?,?,?,?)
+    ON CONFLICT(id) DO UPDATE SET name = excluded.name,followers = excluded.followers,popularity = excluded.popularity""",
+    'artist_members':"""INSERT OR REPLACE INTO artist_members (artist_id,position,band_member_name,birthday,birthday_year,birthday_month,birthday_day,deathday,deathday_year,deathday_month,deathday_day,b_d_day_source)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+    'artist_genres':"""INSERT OR REPLACE INTO artist_genres (artist_id,position,genre) VALUES (?,?,?)""",
+    'images':"""INSERT OR REPLACE INTO images (owner_id,position,owner_type,url) VALUES (?,?,?,?)""",
+}
+pending_catalog_writes = {table:[] for table in CATALOG_UPSERTS}
+catalog_lock = threading.RLock()
+lastfm_lock = threading.RLock()
+lastfm_fetches_in_flight = {}
+playcounts_refreshing = set()
+lastfm_executor = ThreadPoolExecutor(max_workers=PLAYCOUNT_FETCH_WORKERS,thread_name_prefix='lastfm')
+playcount_refresh_executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix='lastfm_refresh')
+spotify_fetch_executor = ThreadPoolExecutor(max_workers=SPOTIFY_FETCH_WORKERS,thread_name_prefix='spotify')
+http_cache_lock = threading.Lock()
+http_cache_local = threading.local()
+http_requests_in_flight = {}
+spotify_cache_lock = threading.Lock()
+spotify_cache_memory = OrderedDict()
+spotify_cache_stats = {endpoint:{'memory_hits':0,'disk_hits':0,'misses':0} for endpoint in SPOTIFY_CACHE_TTL_HOURS}
+enrichment_wakeup = threading.Event()
+email_wakeup = threading.Event()
+ids_in_progress = {}
+metrics_lock = threading.Lock()
+metrics_local = threading.local()
+process_metrics = {}
+run_metrics = {'run_id':None,'metrics':{}}
+
+API_RATE_LIMITS = {
+    'spotify':(5.0,10),
+    'lastfm':(5.0,5),
+    'musicbrainz':(1.0,1),
+    'wikipedia':(10.0,10),
+    'famousbirthdays':(1.0,2),
+    'smtp':(0.5,5),
+}
+UPSTREAM_HOSTS = {'api.spotify.com':'spotify'}
+UPSTREAM_HOSTS.update({urlparse(base_url).netloc:upstream for upstream, base_url in HTTP_BASE_URLS.items()})
+
+class TokenBucket:
+    def __init__(self,rate,capacity):
+        self.rate, self.capacity, self.tokens, self.updated = rate, capacity, capacity, time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+RATE_LIMITERS = {upstream:TokenBucket(rate,capacity) for upstream, (rate,capacity) in API_RATE_LIMITS.items()}
+
+def add_metric(metrics,name,count,seconds):
+    entry = metrics.setdefault(name,[0,0.0])
+    entry[0] += count
+    entry[1] += seconds
+
+def record_metric(name,count=1,seconds=0.0):
+    with metrics_lock:
+        add_metric(process_metrics,name,count,seconds)
+        add_metric(run_metrics['metrics'],name,count,seconds)
+    user_metrics = getattr(metrics_local,'user_metrics',None)
+    if user_metrics is not None:
+        add_metric(user_metrics,name,count,seconds)
+
+def count_event(upstream,event,count=1):
+    if count > 0:
+        record_metric(f"{event}:{upstream}",count)
+
+@contextmanager
+def timed_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_metric(f"stage:{stage}",1,time.perf_counter() - started)
+
+def write_metrics(conn,scope,subject,metrics):
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO metrics (run_id,scope,subject,name,count,seconds,recorded_at) VALUES (?,?,?,?,?,?,?)",
+        ((run_metrics['run_id'],scope,subject,name,count,seconds,int(time.time())) for name, (count,seconds) in metrics.items()))
+
+def log_metrics(subject,metrics):
+    for name, (count,seconds) in sorted(metrics.items()):
+        logging.info(f"METRICS | {subject} | {name} | {count} | {round(seconds,3)}s" if name.startswith('stage:') else f"METRICS | {subject} | {name} | {count}")
+
+def start_run_metrics():
+    with metrics_lock:
+        run_metrics['run_id'], run_metrics['metrics'] = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}", {}
+
+def finish_run_metrics(conn):
+    with metrics_lock:
+        metrics = {name:list(entry) for name, entry in run_metrics['metrics'].items()}
+    log_metrics('RUN',metrics)
+    write_metrics(conn,'run','',metrics)
+
+def start_user_metrics():
+    metrics_local.user_metrics = {}
+
+def finish_user_metrics(spotify_id):
+    metrics, metrics_local.user_metrics = getattr(metrics_local,'user_metrics',{}), None
+    log_metrics(spotify_id,metrics)
+    try:
+        with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+            write_metrics(conn,'user',spotify_id,metrics)
+    except Exception as e:
+        logging.error(f"{spotify_id} | COULDN'T WRITE METRICS | {e}")
+
+def prometheus_metrics_text():
+    with metrics_lock:
+        metrics = {name:list(entry) for name, entry in process_metrics.items()}
+    families = {'musicbirthday_stage_seconds_total':[],'musicbirthday_stage_total':[],'musicbirthday_events_total':[]}
+    for name, (count,seconds) in sorted(metrics.items()):
+        kind, label = name.split(':',1)
+        if kind == 'stage':
+            families['musicbirthday_stage_seconds_total'].append(f'musicbirthday_stage_seconds_total{{stage="{label}"}} {seconds}')
+            families['musicbirthday_stage_total'].append(f'musicbirthday_stage_total{{stage="{label}"}} {count}')
+        else:
+            families['musicbirthday_events_total'].append(f'musicbirthday_events_total{{event="{kind}",upstream="{label}"}} {count}')
+    lines = [line for family, samples in families.items() for line in [f"# TYPE {family} counter"] + samples]
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_metrics_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type','text/plain; version=0.0.4')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+def start_metrics_server(port):
+    server = ThreadingHTTPServer(('127.0.0.1',port),MetricsHandler)
+    threading.Thread(target=server.serve_forever,name='metrics',daemon=True).start()
+    logging.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    return server
+
+def rate_limit(upstream):
+    count_event(upstream,'api_calls')
+    RATE_LIMITERS[upstream].acquire()
+
+def retry_after_seconds(response):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if not retry_after:
+        return None
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(retry_after) - datetime.now(parsedate_to_datetime(retry_after).tzinfo)).total_seconds()
+        except (TypeError,ValueError):
+            return None
+    return min(max(seconds,0),HTTP_MAX_RETRY_AFTER_SECONDS)
+
+class UpstreamUnavailable(Exception):
+    pass
+
+def raise_if_unavailable(url,response):
+    if response is None or response.status_code in HTTP_RETRY_STATUSES or response.status_code >= 500:
+        raise UpstreamUnavailable(f"{url} | {'NO RESPONSE' if response is None else response.status_code}")
+
+class HttpClient:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,name='http',daemon=True)
+        self.thread.start()
+        self.client = asyncio.run_coroutine_threadsafe(self.open(),self.loop).result()
+        self.semaphores = {}
+
+    async def open(self):
+        return httpx.AsyncClient(headers={'User-Agent':HTTP_USER_AGENT},timeout=HTTP_TIMEOUT_SECONDS,follow_redirects=True,
+        limits=httpx.Limits(max_connections=sum(HTTP_HOST_CONCURRENCY.values()),max_keepalive_connections=sum(HTTP_HOST_CONCURRENCY.values())))
+
+    def semaphore(self,upstream):
+        if upstream not in self.semaphores:
+            self.semaphores[upstream] = asyncio.Semaphore(HTTP_HOST_CONCURRENCY.get(upstream,HTTP_HOST_CONCURRENCY['default']))
+        return self.semaphores[upstream]
+
+    async def request(self,url,params=None,headers=None):
+        upstream = UPSTREAM_HOSTS.get(urlparse(url).netloc,'default')
+        for attempt in range(HTTP_MAX_RETRIES+1):
+            response, error = None, None
+            async with self.semaphore(upstream):
+                if upstream in RATE_LIMITERS:
+                    await asyncio.sleep(RATE_LIMITERS[upstream].reserve())
+                count_event(upstream,'api_calls')
+                try:
+                    response = await self.client.get(url,params=params,headers=headers)
+                except httpx.HTTPError as e:
+                    error = e
+            if response is not None and response.status_code not in HTTP_RETRY_STATUSES:
+                return response
+            if attempt == HTTP_MAX_RETRIES:
+                break
+            count_event(upstream,'retries')
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = HTTP_BACKOFF_SECONDS * 2**attempt * random.uniform(0.5,1.5)
+            logging.warning(f"{url} | {error or response.status_code} | RETRYING IN {round(delay,1)}s | {HTTP_MAX_RETRIES-attempt} retries left")
+            await asyncio.sleep(delay)
+        logging.error(f"{url} | {error or response.status_code} | GIVING UP")
+        count_event(upstream,'failures')
+        return response
+
+    def get(self,url,params=None,headers=None):
+        return asyncio.run_coroutine_threadsafe(self.request(url,params,headers),self.loop).result()
+
+http_client_lock = threading.Lock()
+http_client_instance = None
+
+def http_get(url,params=None,headers=None):
+    global http_client_instance
+    if http_client_instance is None:
+        with http_client_lock:
+            if http_client_instance is None:
+                http_client_instance = HttpClient()
+    return http_client_instance.get(url,params,headers)
+
 def configure_logging():
     logging.getLogger().setLevel(logging.INFO)
     file_handler = logging.FileHandler(f"musicbirthday.log")
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'))
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'))
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(funcName)s - %(message)s'))
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(funcName)s - %(message)s'))
     logging.getLogger().addHandler(file_handler)
     logging.getLogger().addHandler(console_handler)
 
@@ -52,52 +630,32 @@ def spotify_oauth_1():
 def spotify_helper_object():
     return spotipy.Spotify(auth_manager=SpotifyOAuth(SPOTIPY_001_CLIENT_ID,SPOTIPY_001_CLIENT_SECRET,'http://localhost:8000/callback',scope='',cache_path='.cache3'),requests_timeout=5)
 
-def generate_album_row(album):
-    row_to_add = [''] * 71
-    row_to_add[0], row_to_add[1], row_to_add[2] = album['id'], album['album_type'], album['total_tracks']
-    row_to_add_curr_index = 3
-    for image_url in album.get('images',[]):
-        row_to_add[row_to_add_curr_index] = image_url['url']
-        row_to_add_curr_index += 1
-        if row_to_add_curr_index >= 7:
-            logging.critical("TOO MANY IMAGE_URLS, GOTTA CHANGE 'albums.csv'!")
-            exit()
-    row_to_add[7], row_to_add[8], row_to_add[9] = album['name'], album['release_date'], album['release_date_precision']
-    row_to_add_curr_index = 10
-    for artist in album['artists']:
-        row_to_add[row_to_add_curr_index] = artist['id']
-        row_to_add_curr_index += 1
-        if row_to_add_curr_index >= 70:
-            logging.critical("TOO MANY ARTISTS, GOTTA CHANGE 'albums.csv'!")
-            exit()
-    row_to_add[70] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return row_to_add, album['id']
-
-def generate_artist_rows(artist):
-    rows_to_add = []
-    row_to_add = [''] * 34
-    row_to_add[0], row_to_add[1]  = artist['id'], str(artist['followers'].get('total',0))
-    row_to_add_curr_index = 2
-    for genre in artist.get('genres',[]):
-        row_to_add[row_to_add_curr_index] = genre
-        row_to_add_curr_index += 1
-        if row_to_add_curr_index >= 22:
-            logging.critical("TOO MANY GENRES, NEED TO CHANGE 'artists.csv'!")
-            exit()
-    row_to_add_curr_index = 22
-    for image_url in artist.get('images',[]):
-        row_to_add[row_to_add_curr_index] = image_url['url']
-        row_to_add_curr_index += 1
-        if row_to_add_curr_index >= 27:
-            logging.critical("TOO MANY IMAGE_URLS, GOTTA CHANGE 'artists.csv'!")
-            exit()
-    row_to_add[27], row_to_add[28], row_to_add[33]  = artist['name'], str(artist.get('popularity',0)), datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    for rta in handle_birthday_deathday(artist):
-        row_to_add_temp = row_to_add[:]
-        row_to_add_temp[29], row_to_add_temp[30], row_to_add_temp[31], row_to_add_temp[32] = rta[0], rta[1], rta[2], rta[3]
-        rows_to_add.append(row_to_add_temp)
-    logging.info(rows_to_add)
-    return rows_to_add
+def spotify_catalog_object():
+    return spotipy.Spotify(auth_manager=SpotifyClientCredentials(SPOTIPY_001_CLIENT_ID,SPOTIPY_001_CLIENT_SECRET),requests_timeout=5)
+
+def date_columns(date_string):
+    date_value = handle_date(date_string or '')
+    if date_value is None:
+        return date_string, None, None, None
+    return date_string, date_value.year, date_value.month, date_value.day
+
+def generate_album_catalog_rows(album,added=None):
+    added = added or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    release_date, release_year, release_month, release_day = date_columns(album['release_date'])
+    return {
+        'albums':[(album['id'],album['album_type'],album['total_tracks'],album['name'],release_date,album['release_date_precision'],release_year,release_month,release_day,added)],
+        'album_artists':[(album['id'],position,artist['id']) for position, artist in enumerate(album['artists'])],
+        'images':[(album['id'],position,'album',image_url['url']) for position, image_url in enumerate(album.get('images',[]))],
+    }
+
+def generate_artist_catalog_rows(artist,members,added=None):
+    added = added or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'artists':[(artist['id'],artist['name'],int(artist['followers'].get('total',0) or 0),int(artist.get('popularity',0) or 0),added)],
+        'artist_members':[(artist['id'],position,band_member)+date_columns(birthday)+date_columns(deathday)+(source,) for position, (band_member, birthday, deathday, source) in enumerate(members)],
+        'artist_genres':[(artist['id'],position,genre) for position, genre in enumerate(artist.get('genres',[]))],
+        'images':[(artist['id'],position,'artist',image_url['url']) for position, image_url in enumerate(artist.get('images',[]))],
+    }
 
 def handle_date(date_string):
     if len(date_string)==0:
@@ -109,117 +667,572 @@ def handle_date(date_string):
             pass
     return None
 
-def cached_musicbirthday_values():
-    month_to_match, day_to_match = datetime.today().month, datetime.today().day
-    to_return = {'birthday':{},'deathday':{},'release_date':{}}
-    artists_already_written, albums_already_written = set(), set()
-    logging.info(f"Loading cached values")
-    with open('artists.csv','r',encoding='utf-8') as infile:
+TIME_RANGES = ('short','medium','long')
+TIME_RANGE_CODES = {time_range:code for code, time_range in enumerate(TIME_RANGES)}
+ID_TYPE_CODES = {'album':0,'artist':1,'track':2}
+
+class MatchKind(IntEnum):
+    TRACK_ALBUM_RELEASE_DATE = 0
+    ARTIST_RELEASE_DATE_TOP_ALBUM = 1
+    TRACK_ARTIST_BIRTHDAY_MAIN = 2
+    TRACK_ARTIST_BIRTHDAY_SUPPORT = 3
+    TRACK_ARTIST_DEATHDAY_MAIN = 4
+    TRACK_ARTIST_DEATHDAY_SUPPORT = 5
+    ARTIST_BIRTHDAY_TOP = 6
+    ARTIST_DEATHDAY_TOP = 7
+
+class Occasion(IntEnum):
+    RELEASE_DATE = 0
+    BIRTHDAY = 1
+    DEATHDAY = 2
+
+MATCH_KIND_OCCASIONS = (Occasion.RELEASE_DATE,Occasion.RELEASE_DATE,Occasion.BIRTHDAY,Occasion.BIRTHDAY,Occasion.DEATHDAY,Occasion.DEATHDAY,Occasion.BIRTHDAY,Occasion.DEATHDAY)
+
+def match_reason(time_range,kind):
+    return TIME_RANGE_CODES[time_range] << 3 | kind
+
+def reason_kind(reason):
+    return MatchKind(reason & 7)
+
+def reason_occasion(reason):
+    return MATCH_KIND_OCCASIONS[reason & 7]
+
+def reason_name(reason):
+    return f"{TIME_RANGES[reason >> 3]}_{reason_kind(reason).name.lower()}"
+
+class ArtistDateMatch:
+    __slots__ = ('year','band_member')
+
+    def __init__(self,year,band_member):
+        self.year, self.band_member = year, band_member
+
+class AlbumReleaseMatch:
+    __slots__ = ('year','release_type','artist_ids')
+
+    def __init__(self,year,release_type,artist_ids):
+        self.year, self.release_type, self.artist_ids = year, release_type, artist_ids
+
+class Match:
+    __slots__ = ('reason','id_type','year','band_member')
+
+    def __init__(self,reason,id_type,year,band_member=''):
+        self.reason, self.id_type, self.year, self.band_member = reason, id_type, year, band_member
+
+class Candidate:
+    __slots__ = ('reason','id_type','track_name','artist_ids','artist_names','popularity','track_playcount','track_duration_ms','score','year','band_member','full_track_name')
+
+def create_catalog_tables(conn):
+    conn.executescript(CATALOG_SCHEMA)
+    conn.executescript(CATALOG_CHANGES_SCHEMA)
+
+def queue_catalog_rows(conn,catalog_rows):
+    with catalog_lock:
+        for table, rows in catalog_rows.items():
+            pending_catalog_writes[table].extend(rows)
+        if sum(len(rows) for rows in pending_catalog_writes.values()) >= CATALOG_BATCH_SIZE:
+            flush_catalog_writes(conn)
+
+def flush_catalog_writes(conn):
+    with catalog_lock:
+        if not any(pending_catalog_writes.values()):
+            return
+        with conn:
+            for table, rows in pending_catalog_writes.items():
+                if rows:
+                    conn.executemany(CATALOG_UPSERTS[table],rows)
+                    logging.info(f"WROTE {len(rows)} ROWS TO '{table}'")
+                    rows.clear()
+
+def claim_new_id(id_to_claim,ids_already_claimed):
+    with catalog_lock:
+        if id_to_claim in ids_already_claimed:
+            return False
+        ids_already_claimed.add(id_to_claim)
+        return True
+
+def claim_id_and_wait(id_to_claim,ids_already_claimed):
+    with catalog_lock:
+        if id_to_claim not in ids_already_claimed:
+            ids_already_claimed.add(id_to_claim)
+            ids_in_progress[(id(ids_already_claimed),id_to_claim)] = threading.Event()
+            return True
+        in_progress = ids_in_progress.get((id(ids_already_claimed),id_to_claim))
+    if in_progress is not None:
+        in_progress.wait()
+    return False
+
+def release_claimed_id(id_to_claim,ids_already_claimed,keep_claim=True):
+    with catalog_lock:
+        if not keep_claim:
+            ids_already_claimed.discard(id_to_claim)
+        in_progress = ids_in_progress.pop((id(ids_already_claimed),id_to_claim),None)
+    if in_progress is not None:
+        in_progress.set()
+
+def import_catalog_csvs(conn):
+    logging.info("Importing 'artists.csv' and 'albums.csv' into the catalog tables")
+    with open('albums.csv','r',encoding='utf-8-sig') as infile:
         reader = csv.reader(infile,delimiter=',')
         next(reader)
-        for artist_row in reader:
-            artist_id, band_member, birthday, deathday = artist_row[0], artist_row[-5], handle_date(artist_row[-4]), handle_date(artist_row[-3])
-            artists_already_written.add(artist_id)
-            if birthday is not None and month_to_match == birthday.month and day_to_match == birthday.day:
-                to_return['birthday'][artist_id] = {'band_member':band_member,'date':birthday}
-            if deathday is not None and month_to_match == deathday.month and day_to_match == deathday.day:
-                to_return['deathday'][artist_id] = {'band_member':band_member,'date':deathday}
-    with open('albums.csv','r',encoding='utf-8') as infile:
+        for album_row in reader:
+            album = {'id':album_row[0],'album_type':album_row[1],'total_tracks':album_row[2],'images':[{'url':url} for url in album_row[3:7] if url],'name':album_row[7],
+                     'release_date':album_row[8],'release_date_precision':album_row[9],'artists':[{'id':artist_id} for artist_id in album_row[10:70] if artist_id]}
+            queue_catalog_rows(conn,generate_album_catalog_rows(album,album_row[70]))
+    artist_members = {}
+    with open('artists.csv','r',encoding='utf-8-sig') as infile:
         reader = csv.reader(infile,delimiter=',')
         next(reader)
-        for album_row in reader:
-            album_id, release_type, release_date, artist_ids = album_row[0], album_row[1], handle_date(album_row[8]), set(album_row[10:69])
-            artist_ids.discard("")
-            albums_already_written.add(album_id)
-            if release_date is not None and release_date.year <= MOST_RECENT_YEAR and month_to_match == release_date.month and day_to_match == release_date.day and release_type.upper() != 'COMPILATION':
-                to_return['release_date'][album_id] = {'type':release_type,'date':release_date,'artist_ids':artist_ids}
+        for artist_row in reader:
+            if artist_row[0] not in artist_members:
+                artist_members[artist_row[0]] = ({'id':artist_row[0],'followers':{'total':artist_row[1]},'genres':[genre for genre in artist_row[2:22] if genre],
+                                                  'images':[{'url':url} for url in artist_row[22:27] if url],'name':artist_row[27],'popularity':artist_row[28]},[],artist_row[33])
+            artist_members[artist_row[0]][1].append(artist_row[29:33])
+    for artist, members, added in artist_members.values():
+        queue_catalog_rows(conn,generate_artist_catalog_rows(artist,members,added))
+    flush_catalog_writes(conn)
+
+def pack_month_day(month,day):
+    return month << 5 | day if month and day else 0
+
+def drop_catalog_change_triggers(conn):
+    triggers = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ('tr_albums_insert','tr_albums_update','tr_album_artists_insert','tr_artists_insert','tr_artist_members_insert')")]
+    if len(triggers) == 0 and conn.execute("SELECT count(*) FROM catalog_snapshot_builds").fetchone()[0] == 0:
+        return
+    with conn:
+        for trigger in triggers:
+            conn.execute(f"DROP TRIGGER {trigger}")
+        dropped = conn.execute("DELETE FROM catalog_changes").rowcount
+        conn.execute("DELETE FROM catalog_snapshot_builds")
+    logging.info(f"NO {CATALOG_SNAPSHOT_FILE} | DROPPED CATALOG CHANGE TRIGGERS AND {dropped} LOGGED CHANGES")
+
+def build_catalog_snapshot(conn,path=CATALOG_SNAPSHOT_FILE):
+    create_catalog_tables(conn)
+    flush_catalog_writes(conn)
+    conn.executescript(CATALOG_CHANGES_TRIGGERS)
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    try:
+        seq = conn.execute("SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'catalog_changes'),0)").fetchone()[0]
+        albums = conn.execute("SELECT id,album_type,release_year,release_month,release_day FROM albums ORDER BY id").fetchall()
+        album_artists = conn.execute("SELECT album_id,artist_id FROM album_artists ORDER BY album_id,position").fetchall()
+        members = conn.execute("""SELECT artist_id,band_member_name,birthday_year,birthday_month,birthday_day,deathday_year,deathday_month,deathday_day FROM artist_members
+        ORDER BY artist_id,position""").fetchall()
+        artists_written = {row[0] for row in conn.execute("SELECT id FROM artists")}
+    finally:
+        conn.commit()
+    artist_ids = sorted(artists_written | {row[1] for row in album_artists} | {row[0] for row in members})
+    artist_indexes, album_indexes = {artist_id:index for index, artist_id in enumerate(artist_ids)}, {row[0]:index for index, row in enumerate(albums)}
+    album_types = sorted({row[1] for row in albums},key=lambda album_type: (album_type is None,album_type or ''))
+    album_type_codes, strings, string_codes = {album_type:code for code, album_type in enumerate(album_types)}, [None], {None:0}
+    id_width = max([len(id_.encode('utf-8')) for id_ in artist_ids] + [len(row[0].encode('utf-8')) for row in albums] + [1])
+    sections = {
+        'artist_ids':np.array([id_.encode('utf-8') for id_ in artist_ids],dtype=f"S{id_width}"),
+        'artist_written':np.array([artist_id in artists_written for artist_id in artist_ids],dtype=np.uint8),
+        'album_ids':np.array([row[0].encode('utf-8') for row in albums],dtype=f"S{id_width}"),
+        'album_years':np.array([row[2] or 0 for row in albums],dtype=np.uint16),
+        'album_month_days':np.array([pack_month_day(row[3],row[4]) for row in albums],dtype=np.uint16),
+        'album_types':np.array([album_type_codes[row[1]] for row in albums],dtype=np.uint16),
+    }
+    adjacency = [(album_indexes[album_id],artist_indexes[artist_id]) for album_id, artist_id in album_artists if album_id in album_indexes]
+    sections['album_artist_offsets'] = np.concatenate(([0],np.cumsum(np.bincount(np.array([pair[0] for pair in adjacency],dtype=np.int64),minlength=len(albums))))).astype(np.uint32)
+    sections['album_artist_list'] = np.array([pair[1] for pair in adjacency],dtype=np.uint32)
+    adjacency.sort(key=lambda pair: (pair[1],pair[0]))
+    sections['artist_album_offsets'] = np.concatenate(([0],np.cumsum(np.bincount(np.array([pair[1] for pair in adjacency],dtype=np.int64),minlength=len(artist_ids))))).astype(np.uint32)
+    sections['artist_album_list'] = np.array([pair[0] for pair in adjacency],dtype=np.uint32)
+    release_order = np.argsort(sections['album_month_days'],kind='stable')
+    release_order = release_order[sections['album_month_days'][release_order] > 0]
+    sections['release_days'], sections['release_albums'] = sections['album_month_days'][release_order], release_order.astype(np.uint32)
+    for key, column in (('birthday',2),('deathday',5)):
+        rows = []
+        for member in members:
+            month_day = pack_month_day(member[column+1],member[column+2])
+            if month_day:
+                if member[1] not in string_codes:
+                    string_codes[member[1]] = len(strings)
+                    strings.append(member[1])
+                rows.append((month_day,member[column] or 0,artist_indexes[member[0]],string_codes[member[1]]))
+        rows.sort(key=lambda row: row[0])
+        sections[f"{key}_days"] = np.array([row[0] for row in rows],dtype=np.uint16)
+        sections[f"{key}_years"] = np.array([row[1] for row in rows],dtype=np.uint16)
+        sections[f"{key}_artists"] = np.array([row[2] for row in rows],dtype=np.uint32)
+        sections[f"{key}_names"] = np.array([row[3] for row in rows],dtype=np.uint32)
+    encoded_strings = [(string or '').encode('utf-8') for string in strings]
+    sections['string_offsets'] = np.concatenate(([0],np.cumsum([len(string) for string in encoded_strings]))).astype(np.uint32)
+    sections['string_blob'] = np.frombuffer(b''.join(encoded_strings),dtype=np.uint8)
+    layout, offset = {}, 0
+    for name, array in sections.items():
+        layout[name] = (array.dtype.str,offset,len(array))
+        offset += -(-array.nbytes // 8) * 8
+    header = json.dumps({'seq':seq,'built_at':int(time.time()),'id_width':id_width,'album_types':album_types,'sections':layout}).encode('utf-8')
+    with open(path+'.tmp','wb') as outfile:
+        outfile.write(struct.pack('<8sI',CATALOG_SNAPSHOT_MAGIC,len(header)) + header)
+        outfile.write(b'\0' * (-outfile.tell() % 8))
+        data_start = outfile.tell()
+        for name, array in sections.items():
+            outfile.seek(data_start + layout[name][1])
+            outfile.write(array.tobytes())
+        outfile.truncate(data_start + offset)
+    os.replace(path+'.tmp',path)
+    with conn:
+        pruned_through = conn.execute("SELECT coalesce(max(seq),0) FROM catalog_snapshot_builds WHERE seq < ?",(seq,)).fetchone()[0]
+        conn.execute("DELETE FROM catalog_changes WHERE seq <= ?",(pruned_through,))
+        conn.execute("INSERT OR REPLACE INTO catalog_snapshot_builds (seq,built_at,pruned_through) VALUES (?,?,?)",(seq,int(time.time()),pruned_through))
+    logging.info(f"BUILT SNAPSHOT {path} | {len(artist_ids)} ARTISTS | {len(albums)} ALBUMS | {len(members)} MEMBERS | {(data_start+offset)/1024:.0f} KB | SEQ {seq} | {time.perf_counter()-started:.2f}s")
+    return path
+
+class CatalogSnapshot:
+    def __init__(self,path=CATALOG_SNAPSHOT_FILE):
+        with open(path,'rb') as infile:
+            self.mtime_ns = os.fstat(infile.fileno()).st_mtime_ns
+            self.mmap = mmap.mmap(infile.fileno(),0,access=mmap.ACCESS_READ)
+        magic, header_length = struct.unpack_from('<8sI',self.mmap,0)
+        if magic != CATALOG_SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} IS NOT A CATALOG SNAPSHOT")
+        header = json.loads(self.mmap[12:12+header_length])
+        data_start = -(-(12+header_length) // 8) * 8
+        self.path, self.seq, self.changes_seq, self.id_width, self.album_types = path, header['seq'], header['seq'], header['id_width'], header['album_types']
+        self.arrays = {name:np.frombuffer(self.mmap,dtype=dtype,count=count,offset=data_start+offset) for name, (dtype,offset,count) in header['sections'].items()}
+        self.skip_album_types = {code for code, album_type in enumerate(self.album_types) if album_type is None or album_type.upper() == 'COMPILATION'}
+        self.changed, self.lock = {'album':set(),'artist':set()}, threading.Lock()
+
+    def find(self,name,id_):
+        ids, key = self.arrays[name], id_.encode('utf-8')
+        if len(key) > self.id_width or len(ids) == 0:
+            return -1
+        index = int(np.searchsorted(ids,key))
+        return index if index < len(ids) and ids[index] == key else -1
+
+    def contains(self,kind,id_):
+        if kind == 'album':
+            return self.find('album_ids',id_) >= 0
+        index = self.find('artist_ids',id_)
+        return index >= 0 and bool(self.arrays['artist_written'][index])
+
+    def count(self,kind):
+        return len(self.arrays['album_ids']) if kind == 'album' else int(self.arrays['artist_written'].sum())
+
+    def artist_id(self,index):
+        return self.arrays['artist_ids'][index].decode('utf-8')
+
+    def album_id(self,index):
+        return self.arrays['album_ids'][index].decode('utf-8')
+
+    def string(self,index):
+        if index == 0:
+            return None
+        offsets = self.arrays['string_offsets']
+        return self.arrays['string_blob'][offsets[index]:offsets[index+1]].tobytes().decode('utf-8')
+
+    def day_range(self,name,month_to_match,day_to_match):
+        days, month_day = self.arrays[name], pack_month_day(month_to_match,day_to_match)
+        return int(np.searchsorted(days,month_day,'left')), int(np.searchsorted(days,month_day,'right'))
+
+    def released_album(self,album_index,most_recent_year):
+        year = int(self.arrays['album_years'][album_index])
+        return 0 < year <= most_recent_year and int(self.arrays['album_types'][album_index]) not in self.skip_album_types
+
+    def refresh_changes(self,conn):
+        with self.lock:
+            rows = conn.execute("SELECT seq,kind,id FROM catalog_changes WHERE seq > ? ORDER BY seq",(self.changes_seq,)).fetchall()
+            for seq, kind, id_ in rows:
+                self.changed[kind].add(id_)
+            if rows:
+                self.changes_seq = rows[-1][0]
+            return self.changes_seq
+
+    def musicbirthday_values(self,month_to_match,day_to_match,most_recent_year):
+        to_return = {'birthday':{},'deathday':{},'release_date':{}}
+        for key in ('birthday','deathday'):
+            start, end = self.day_range(f"{key}_days",month_to_match,day_to_match)
+            for artist_index, year, name_index in zip(self.arrays[f"{key}_artists"][start:end].tolist(),self.arrays[f"{key}_years"][start:end].tolist(),self.arrays[f"{key}_names"][start:end].tolist()):
+                artist_id = self.artist_id(artist_index)
+                if artist_id not in self.changed['artist']:
+                    to_return[key][artist_id] = ArtistDateMatch(year or None,self.string(name_index))
+        offsets, artist_list = self.arrays['album_artist_offsets'], self.arrays['album_artist_list']
+        start, end = self.day_range('release_days',month_to_match,day_to_match)
+        for album_index in self.arrays['release_albums'][start:end].tolist():
+            album_id = self.album_id(album_index)
+            if self.released_album(album_index,most_recent_year) and album_id not in self.changed['album']:
+                to_return['release_date'][album_id] = AlbumReleaseMatch(int(self.arrays['album_years'][album_index]),self.album_types[self.arrays['album_types'][album_index]],
+                                                                        {self.artist_id(artist_index) for artist_index in artist_list[offsets[album_index]:offsets[album_index+1]].tolist()})
+        return to_return
+
+    def albums_released_on_day_by_artist(self,artist_id,month_to_match,day_to_match,most_recent_year):
+        artist_index = self.find('artist_ids',artist_id)
+        if artist_index < 0:
+            return []
+        month_day, offsets = pack_month_day(month_to_match,day_to_match), self.arrays['artist_album_offsets']
+        to_return = []
+        for album_index in self.arrays['artist_album_list'][offsets[artist_index]:offsets[artist_index+1]].tolist():
+            if self.arrays['album_month_days'][album_index] == month_day and self.released_album(album_index,most_recent_year):
+                album_id = self.album_id(album_index)
+                if album_id not in self.changed['album']:
+                    to_return.append((album_id,int(self.arrays['album_years'][album_index])))
+        return to_return
+
+class SnapshotIdSet:
+    def __init__(self,snapshot,kind,overlay):
+        self.snapshot, self.kind, self.overlay = snapshot, kind, {id_ for id_ in overlay if not snapshot.contains(kind,id_)}
+
+    def __contains__(self,id_):
+        return id_ in self.overlay or self.snapshot.contains(self.kind,id_)
+
+    def __len__(self):
+        return self.snapshot.count(self.kind) + len(self.overlay)
+
+    def add(self,id_):
+        if not self.snapshot.contains(self.kind,id_):
+            self.overlay.add(id_)
+
+def catalog_snapshot_mtime(path=CATALOG_SNAPSHOT_FILE):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def open_catalog_snapshot(conn,path=CATALOG_SNAPSHOT_FILE):
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = CatalogSnapshot(path)
+    except (OSError,ValueError,KeyError) as e:
+        logging.warning(f"{path} | {e} | IGNORING SNAPSHOT")
+        return None
+    last_seq = conn.execute("SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'catalog_changes'),0)").fetchone()[0]
+    pruned_through = conn.execute("SELECT coalesce(max(pruned_through),0) FROM catalog_snapshot_builds").fetchone()[0]
+    if not pruned_through <= snapshot.seq <= last_seq:
+        logging.warning(f"{path} | SEQ {snapshot.seq} OUTSIDE {pruned_through}..{last_seq} | IGNORING SNAPSHOT, RUN build-snapshot")
+        return None
+    snapshot.refresh_changes(conn)
+    logging.info(f"Opened snapshot {path} | SEQ {snapshot.seq} | {snapshot.changes_seq - snapshot.seq} CHANGES IN OVERLAY")
+    return snapshot
+
+def load_musicbirthday_index(conn):
+    create_catalog_tables(conn)
+    if conn.execute("SELECT (SELECT count(*) FROM albums) + (SELECT count(*) FROM artists)").fetchone()[0] == 0:
+        import_catalog_csvs(conn)
+    snapshot_mtime, snapshot = catalog_snapshot_mtime(), open_catalog_snapshot(conn)
+    if snapshot_mtime is None:
+        drop_catalog_change_triggers(conn)
+    if snapshot is None:
+        musicbirthday_index = {
+            'artists_already_written':{row[0] for row in conn.execute("SELECT id FROM artists")},
+            'albums_already_written':{row[0] for row in conn.execute("SELECT id FROM albums")}
+        }
+    else:
+        musicbirthday_index = {
+            'artists_already_written':SnapshotIdSet(snapshot,'artist',{row[0] for row in conn.execute("SELECT id FROM artists WHERE id IN (SELECT id FROM catalog_changes WHERE kind = 'artist' AND seq > ?)",(snapshot.seq,))}),
+            'albums_already_written':SnapshotIdSet(snapshot,'album',{row[0] for row in conn.execute("SELECT id FROM albums WHERE id IN (SELECT id FROM catalog_changes WHERE kind = 'album' AND seq > ?)",(snapshot.seq,))})
+        }
+    musicbirthday_index['snapshot'], musicbirthday_index['snapshot_mtime'] = snapshot, snapshot_mtime
+    logging.info(f"Loaded index | {len(musicbirthday_index['artists_already_written'])} ARTISTS | {len(musicbirthday_index['albums_already_written'])} ALBUMS | {'SNAPSHOT' if snapshot else 'SQLITE'}")
+    return musicbirthday_index
+
+def changed_since_snapshot(snapshot,kind,column):
+    if snapshot is None:
+        return '', ()
+    return f" AND {column} IN (SELECT id FROM catalog_changes WHERE kind = '{kind}' AND seq > ? AND seq <= ?)", (snapshot.seq,snapshot.changes_seq)
+
+def cached_musicbirthday_values(conn,musicbirthday_index,month_to_match,day_to_match):
+    flush_catalog_writes(conn)
+    snapshot = musicbirthday_index.get('snapshot')
+    if snapshot is None:
+        to_return = {'birthday':{},'deathday':{},'release_date':{}}
+    else:
+        snapshot.refresh_changes(conn)
+        to_return = snapshot.musicbirthday_values(month_to_match,day_to_match,MOST_RECENT_YEAR)
+    artists_filter, artists_params = changed_since_snapshot(snapshot,'artist','artist_id')
+    for key in ('birthday','deathday'):
+        for artist_id, band_member, date_string in conn.execute(f"""SELECT artist_id,band_member_name,{key} FROM artist_members WHERE {key}_month = ? AND {key}_day = ?{artists_filter}
+        ORDER BY artist_id,position""",(month_to_match,day_to_match)+artists_params):
+            date_value = handle_date(date_string)
+            to_return[key][artist_id] = ArtistDateMatch(date_value.year if date_value else None,band_member)
+    albums_filter, albums_params = changed_since_snapshot(snapshot,'album','albums.id')
+    for album_id, release_type, date_string, artist_id in conn.execute(f"""SELECT albums.id,albums.album_type,albums.release_date,album_artists.artist_id FROM albums
+    LEFT JOIN album_artists ON album_artists.album_id = albums.id
+    WHERE albums.release_month = ? AND albums.release_day = ? AND albums.release_year <= ? AND upper(albums.album_type) != 'COMPILATION'{albums_filter}""",(month_to_match,day_to_match,MOST_RECENT_YEAR)+albums_params):
+        if album_id not in to_return['release_date']:
+            date_value = handle_date(date_string)
+            to_return['release_date'][album_id] = AlbumReleaseMatch(date_value.year if date_value else None,release_type,set())
+        if artist_id:
+            to_return['release_date'][album_id].artist_ids.add(artist_id)
     logging.info(f"Loaded data | {len(to_return['birthday'])} BIRTHDAYS | {len(to_return['deathday'])} DEATHDAYS | {len(to_return['release_date'])} ALBUMS")
-    return to_return, artists_already_written, albums_already_written  #artists_already_written, albums_already_written
+    return to_return, musicbirthday_index['artists_already_written'], musicbirthday_index['albums_already_written']
+
+def albums_released_on_day_by_artist(conn,artist_id,month_to_match,day_to_match,snapshot=None):
+    to_return = []
+    if snapshot is not None:
+        snapshot.refresh_changes(conn)
+        to_return = snapshot.albums_released_on_day_by_artist(artist_id,month_to_match,day_to_match,MOST_RECENT_YEAR)
+    albums_filter, albums_params = changed_since_snapshot(snapshot,'album','albums.id')
+    return to_return + conn.execute(f"""SELECT albums.id,albums.release_year FROM album_artists JOIN albums ON albums.id = album_artists.album_id
+    WHERE album_artists.artist_id = ? AND albums.release_month = ? AND albums.release_day = ? AND albums.release_year <= ? AND upper(albums.album_type) != 'COMPILATION'{albums_filter}""",
+    (artist_id,month_to_match,day_to_match,MOST_RECENT_YEAR)+albums_params).fetchall()
+
+def http_cache_connection():
+    if not hasattr(http_cache_local,'conn'):
+        http_cache_local.conn = sqlite3.connect(HTTP_CACHE_FILE,timeout=30)
+        http_cache_local.conn.executescript(HTTP_CACHE_SCHEMA)
+    return http_cache_local.conn
+
+def store_cached_response(key,url,response):
+    upstream = UPSTREAM_HOSTS.get(urlparse(url).netloc)
+    if response is not None and response[0] in HTTP_CACHE_NEGATIVE_STATUSES:
+        status, body, ttl_days = response[0], None, HTTP_CACHE_NEGATIVE_TTL_DAYS
+    elif response is not None and response[0] == 200:
+        status, body, ttl_days = 200, zlib.compress(response[1]), HTTP_CACHE_TTL_DAYS.get(upstream,HTTP_CACHE_TTL_DAYS['default'])
+    else:
+        return
+    conn = http_cache_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO http_cache (key,url,status,body,fetched_at,expires_at) VALUES (?,?,?,?,?,?)",(key,url,status,body,int(time.time()),int(time.time()+ttl_days*24*60*60)))
+
+def cached_request(url,fetch_response):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    cached = http_cache_connection().execute("SELECT status,body FROM http_cache WHERE key = ? AND expires_at > ? AND status != 0",(key,int(time.time()))).fetchone()
+    if cached is not None:
+        count_event(UPSTREAM_HOSTS.get(urlparse(url).netloc,'default'),'cache_hits')
+        logging.info(f"CACHED RESPONSE | {url} | {cached[0]}")
+        return cached[0], None if cached[1] is None else zlib.decompress(cached[1])
+    with http_cache_lock:
+        in_flight = http_requests_in_flight.get(key)
+        if in_flight is None:
+            in_flight = http_requests_in_flight[key] = Future()
+            claimed = True
+        else:
+            claimed = False
+    if not claimed:
+        return in_flight.result()
+    count_event(UPSTREAM_HOSTS.get(urlparse(url).netloc,'default'),'cache_misses')
+    try:
+        response = fetch_response()
+        store_cached_response(key,url,response)
+        in_flight.set_result(response)
+        return response
+    except Exception as e:
+        in_flight.set_exception(e)
+        raise
+    finally:
+        with http_cache_lock:
+            http_requests_in_flight.pop(key,None)
 
 def musicbrainz_request(query_string):
-    num_retries = 3
-    while True:
-        try:
-            mb_object = requests.get(f"https://musicbrainz.org/ws/2/artist/{query_string}",timeout=4)
-            if mb_object.status_code == 503:
-                retry_after = mb_object.headers.get('Retry-After')
-                if retry_after:
-                    logging.warning(f"MUSICBRAINZ rate limit reached | Sleeping {retry_after}")
-                    time.sleep(int(retry_after))
-            else:
-                to_return = mb_object.json()
-                logging.info(to_return)
-                return mb_object.json()
-        except Exception as e:
-            logging.warning(f"{query_string} | {e} | {num_retries} retries left")
-            num_retries -= 1
-            if num_retries < 0:
-                return None
+    url = f"{HTTP_BASE_URLS['musicbrainz']}/ws/2/artist/{query_string}"
+    response = cached_request(url,lambda: fetch_json(url))
+    if response is None or response[0] != 200:
+        return None
+    to_return = json.loads(response[1])
+    logging.debug(to_return)
+    return to_return
 
 def mb_suffix():
     return """?inc=aliases+annotation+area-rels+artist-rels+label-rels+recording-rels+release-rels+release-group-rels+series-rels+url-rels+work-rels+genres+ratings+tags+artist-credits+recordings+releases+release-groups+works&fmt=json"""
 
 def musicbrainz_artist_object(artist_name):
     try:
-        tO_return = musicbrainz_request(musicbrainz_request(f"?query=artist:{quote(artist_name)}&fmt=json")['artists'][0]['id']+mb_suffix())
-        logging.info(f"{to_return}")
+        to_return = musicbrainz_request(musicbrainz_request(f"?query=artist:{quote(artist_name)}&fmt=json")['artists'][0]['id']+mb_suffix())
+        logging.debug(f"{to_return}")
         return to_return
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logging.error(f"{artist_name} | {e}")
         return None
 
+def fetch_url(url,headers=None):
+    response = http_get(url,headers=headers)
+    raise_if_unavailable(url,response)
+    return response.status_code, response.content
+
+def fetch_page(url,headers=None):
+    response = cached_request(url,lambda: fetch_url(url,headers))
+    if response is None or response[0] != 200:
+        return None
+    return response[1]
+
 def soup(url,headers=None):
-    retry_count = 2
-    while True:
-        try:
-            response = requests.get(url,headers=headers,timeout=3)
-            if response.status_code==404:
-                return None
-            return BeautifulSoup(response.content,'html.parser')
-        except Exception as e:
-            retry_count -= 1
-            logging.warning(f"{query_string} | {e} | {retry_count} retries left")
-            if retry_count == 0:
-                return None
+    page = fetch_page(url,headers)
+    if page is None:
+        return None
+    return BeautifulSoup(page,'html.parser')
 
-def get_wikipedia_deathday(soup):
-    try:
-        return soup.find('th', string="Died").find_next_sibling('td').find('span').get_text(strip=True).replace('(','').replace(')','')
-    except Exception as e:
-        logging.warning(f"{e} | ARTIST ISN'T DEAD")
-        return ''
+INFOBOX_START = re.compile(rb'<table[^>]*class="[^"]*\binfobox\b')
+TABLE_TAG = re.compile(rb'<(/?)table\b',re.IGNORECASE)
+INFOBOX_LABELS = {'Born':'born','Died':'died','Birth name':'birth_name','Also known as':'also_known_as'}
 
-def get_artist_real_name(soup_object,artist_name):
-    try:
-        to_return = soup_object.find('th', string="Birth name").find_next_sibling('td').get_text(strip=True)
-    except:
-        try:
-            to_return = soup_object.find('th', string="Born").find_next_sibling('td').find('div', {'class':'nickname'}).get_text(strip=True)
-        except:
-            try:
-                to_return = soup_object.find('th', string="Also known as").find_next_sibling('td').get_text(strip=True)
-            except Exception as e:
-                to_return = artist_name
-    logging.info(f"{artist_name}")
+def slice_wikipedia_infobox(page):
+    start = INFOBOX_START.search(page)
+    if start is None:
+        return None
+    depth = 0
+    for tag in TABLE_TAG.finditer(page,start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return page[start.start():page.index(b'>',tag.end())+1]
+    return page[start.start():]
+
+def element_text(element):
+    return ''.join(text.strip() for text in element.itertext())
+
+def class_names(element):
+    return element.get('class','').split()
+
+def wikipedia_infobox_fields(page):
+    fields = {'bday':'','died':'','birth_name':'','nickname':'','also_known_as':''}
+    infobox = slice_wikipedia_infobox(page)
+    if infobox is None:
+        return fields
+    for element in lxml.html.fromstring(infobox.decode('utf-8','replace')).iter('span','th'):
+        if element.tag == 'span':
+            if not fields['bday'] and 'bday' in class_names(element):
+                fields['bday'] = element_text(element)
+            continue
+        label = INFOBOX_LABELS.get(element_text(element))
+        value = element.getnext()
+        while value is not None and value.tag != 'td':
+            value = value.getnext()
+        if label is None or value is None:
+            continue
+        if label == 'died':
+            span = next(value.iter('span'),None)
+            fields['died'] = '' if span is None else element_text(span).replace('(','').replace(')','')
+        elif label == 'born':
+            nickname = next((div for div in value.iter('div') if 'nickname' in class_names(div)),None)
+            fields['nickname'] = '' if nickname is None else element_text(nickname)
+        else:
+            fields[label] = element_text(value)
+    return fields
+
+def get_artist_real_name(infobox,artist_name):
+    to_return = infobox['birth_name'] or infobox['nickname'] or infobox['also_known_as'] or artist_name
+    logging.info(f"{artist_name} | {to_return}")
     return artist_name
 
-def get_request(url):
-    while True:
+def fetch_json(url):
+    response = http_get(url)
+    raise_if_unavailable(url,response)
+    if response.status_code == 200:
         try:
-            return requests.get(url,timeout=3.5).json()
-        except Exception as e:
-            logging.error(f"{url} | {e}")
-            time.sleep(1.5)
+            response.json()
+        except ValueError as e:
+            raise UpstreamUnavailable(f"{url} | {e}")
+    return response.status_code, response.content
+
+def get_request(url):
+    response = cached_request(url,lambda: fetch_json(url))
+    if response is None or response[0] != 200:
+        return {}
+    return json.loads(response[1])
 
 def handle_birthday_deathday(artist):
     artist_name = artist['name']
     for possible_wiki_ending in ('','_(musician)','_(rapper)'):
-        soup_object = soup(f"https://en.wikipedia.org/wiki/{artist_name}{possible_wiki_ending}")
-        if soup_object is None:
+        page = fetch_page(f"{HTTP_BASE_URLS['wikipedia']}/wiki/{artist_name}{possible_wiki_ending}")
+        if page is None:
             continue
-        wikipedia_birthday = soup_object.find('span',{'class':'bday'})
-        if wikipedia_birthday:
-            to_return = [[get_artist_real_name(soup_object,artist_name),wikipedia_birthday.get_text(strip=True),get_wikipedia_deathday(soup_object),'wikipedia']]
+        infobox = wikipedia_infobox_fields(page)
+        if infobox['bday']:
+            to_return = [[get_artist_real_name(infobox,artist_name),infobox['bday'],infobox['died'],'wikipedia']]
             logging.info(to_return)
             return to_return
     artist_name = artist_name.replace('&','%26')
@@ -245,18 +1258,20 @@ def handle_birthday_deathday(artist):
                 a_names_already_used.add(member_name)
                 member_id = member_object.get('id',None)
                 if member_name and member_id:
-                    member_full_object = get_request(f"https://musicbrainz.org/ws/2/artist/{member_id}/{mb_suffix()}")
+                    member_full_object = get_request(f"{HTTP_BASE_URLS['musicbrainz']}/ws/2/artist/{member_id}/{mb_suffix()}")
                     lifespan_object = member_full_object.get('life-span',dict())
                     if lifespan_object.get('begin',''):
                         to_return.append([member_name,lifespan_object.get('begin',''),lifespan_object.get('end',''),'musicbrainz'])
                         logging.info(to_return)
                     else:
                         try:
-                            famous_birthdays_soup = soup(f"https://www.famousbirthdays.com/people/{member_name.lower().replace(' ','-')}.html")
+                            famous_birthdays_soup = soup(f"{HTTP_BASE_URLS['famousbirthdays']}/people/{member_name.lower().replace(' ','-')}.html")
                             if artist['name'] in str(famous_birthdays_soup):
                                 birthday_value = datetime.strptime(famous_birthdays_soup.find('span',{'class':"type-16-18"}).find_next_sibling('span').text.strip(),"%B %d, %Y").strftime('%Y-%m-%d')
                                 to_return.append([member_name,birthday_value,'','musicbrainz_famousbirthdays'])
                                 logging.info(to_return)
+                        except UpstreamUnavailable:
+                            raise
                         except Exception as e:
                             logging.error(f"{e}")
         if len(to_return)==0:
@@ -268,60 +1283,191 @@ def handle_birthday_deathday(artist):
     logging.info(to_return)
     return to_return
 
-def recently_scanned_(days_lookback = 3):
-    to_return = set()
-    try:
+class ArtistScanTracker:
+    def __init__(self,scanned_at,ttl_days=ARTIST_SCAN_TTL_DAYS):
+        self.scanned_at, self.pending, self.scanning, self.ttl_seconds = scanned_at, {}, set(), ttl_days*24*60*60
+        self.lock = threading.Lock()
+
+    def __contains__(self,artist_id):
+        scanned_at = self.scanned_at.get(artist_id)
+        return artist_id in self.scanning or (scanned_at is not None and scanned_at > time.time() - self.ttl_seconds)
+
+    def __len__(self):
+        return len(self.scanned_at)
+
+    def add(self,artist_id):
+        self.scanning.add(artist_id)
+
+    def discard(self,artist_id):
+        self.scanning.discard(artist_id)
+
+    def mark_scanned(self,artist_id,conn):
+        with self.lock:
+            self.scanning.discard(artist_id)
+            self.scanned_at[artist_id] = self.pending[artist_id] = int(time.time())
+            flush_needed = len(self.pending) >= ARTIST_SCAN_FLUSH_SIZE
+        if flush_needed:
+            self.flush(conn)
+
+    def flush(self,conn):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if len(pending) == 0:
+            return
+        with conn:
+            conn.executemany("INSERT INTO artist_scans (artist_id,scanned_at) VALUES (?,?) ON CONFLICT(artist_id) DO UPDATE SET scanned_at = max(scanned_at,excluded.scanned_at)",pending.items())
+        logging.info(f"WROTE {len(pending)} ARTIST SCANS")
+
+    def compact(self,conn):
+        stale_before = int(time.time() - self.ttl_seconds)
+        with conn:
+            deleted = conn.execute("DELETE FROM artist_scans WHERE scanned_at <= ?",(stale_before,)).rowcount
+        with self.lock:
+            for artist_id in [artist_id for artist_id, scanned_at in self.scanned_at.items() if scanned_at <= stale_before]:
+                del self.scanned_at[artist_id]
+        logging.info(f"COMPACTED ARTIST SCANS | {deleted} STALE ROWS | {len(self.scanned_at)} RECENTLY SCANNED ARTISTS")
+
+def load_artist_scans(conn):
+    conn.executescript(ARTIST_SCANS_SCHEMA)
+    if conn.execute("SELECT count(*) FROM artist_scans").fetchone()[0] == 0 and os.path.exists('artists_recently_scanned.csv'):
+        scanned_at = {}
         with open('artists_recently_scanned.csv','r',encoding='utf-8') as infile:
-            reader = csv.reader(infile,delimiter=',')
-            for row in reader:
-                if handle_date(row[1]) + timedelta(days = days_lookback)>datetime.now():
-                    to_return.add(row[0])
-    except Exception as e:
-        logging.error(f"{e}")
-        pass
-    logging.info(f"FOUND {len(to_return)} RECENTLY SCANNED ARTISTS")
-    return to_return
+            for row in csv.reader(infile,delimiter=','):
+                scan_date = handle_date(row[1]) if len(row) > 1 else None
+                if scan_date is not None:
+                    scanned_at[row[0]] = max(scanned_at.get(row[0],0),int(scan_date.timestamp()))
+        with conn:
+            conn.executemany("INSERT INTO artist_scans (artist_id,scanned_at) VALUES (?,?)",scanned_at.items())
+        logging.info(f"IMPORTED {len(scanned_at)} ARTIST SCANS FROM artists_recently_scanned.csv")
+    artists_scanned = ArtistScanTracker({})
+    artists_scanned.compact(conn)
+    artists_scanned.scanned_at.update(conn.execute("SELECT artist_id,scanned_at FROM artist_scans"))
+    logging.info(f"FOUND {len(artists_scanned)} RECENTLY SCANNED ARTISTS")
+    return artists_scanned
+
+def parse_token_expiry(token_expiry):
+    try:
+        return datetime.fromisoformat(token_expiry).timestamp() if token_expiry else 0
+    except (TypeError,ValueError):
+        return 0
+
+class UserAuthManager:
+    def __init__(self,token_manager,spotify_id):
+        self.token_manager, self.spotify_id = token_manager, spotify_id
+
+    def get_access_token(self,as_dict=False):
+        return self.token_manager.access_token(self.spotify_id)
+
+class SpotifyTokenManager:
+    def __init__(self,sp_oauth=None):
+        self.sp_oauth, self.tokens, self.pending, self.clients = sp_oauth, {}, {}, OrderedDict()
+        self.lock, self.user_locks = threading.Lock(), {}
+
+    def load(self,conn):
+        for spotify_id, refresh_token, access_token, token_expiry in conn.execute("SELECT spotify_id,refresh_token,access_token,token_expiry FROM user"):
+            self.tokens[spotify_id] = {'refresh_token':refresh_token,'access_token':access_token,'expires_at':parse_token_expiry(token_expiry)}
+        logging.info(f"LOADED {len(self.tokens)} ACCESS TOKENS | {len([spotify_id for spotify_id in self.tokens if not self.expiring(spotify_id)])} STILL VALID")
+        return self
+
+    def track(self,spotify_id,refresh_token):
+        with self.lock:
+            token = self.tokens.setdefault(spotify_id,{'refresh_token':refresh_token,'access_token':None,'expires_at':0})
+            if token['refresh_token'] != refresh_token and spotify_id not in self.pending:
+                token.update({'refresh_token':refresh_token,'access_token':None,'expires_at':0})
+            return self.user_locks.setdefault(spotify_id,threading.Lock())
+
+    def expiring(self,spotify_id,margin=60):
+        token = self.tokens[spotify_id]
+        return token['access_token'] is None or token['expires_at'] - margin <= time.time()
+
+    def refresh(self,spotify_id):
+        token = self.tokens[spotify_id]
+        rate_limit('spotify')
+        token_info = self.sp_oauth.refresh_access_token(token['refresh_token'])
+        token.update({'access_token':token_info['access_token'],'refresh_token':token_info.get('refresh_token') or token['refresh_token'],'expires_at':time.time() + token_info.get('expires_in',3600)})
+        with self.lock:
+            self.pending[spotify_id] = (token['access_token'],token['refresh_token'],datetime.fromtimestamp(token['expires_at']).strftime('%Y-%m-%d %H:%M:%S'),spotify_id)
+        count_event('spotify','token_refreshes')
+
+    def access_token(self,spotify_id):
+        with self.user_locks[spotify_id]:
+            if self.expiring(spotify_id):
+                self.refresh(spotify_id)
+            else:
+                count_event('spotify','token_reuses')
+            return self.tokens[spotify_id]['access_token']
+
+    def refresh_expiring(self,conn,user_rows,margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        for user_row in user_rows:
+            self.track(user_row[0],user_row[1])
+        spotify_ids = [user_row[0] for user_row in user_rows if self.expiring(user_row[0],margin)]
+        def refresh_user(spotify_id):
+            try:
+                with self.user_locks[spotify_id]:
+                    self.refresh(spotify_id)
+            except Exception as e:
+                logging.error(f"{spotify_id} | COULDN'T REFRESH ACCESS TOKEN | {e}")
+        with timed_stage('token_refresh'):
+            with ThreadPoolExecutor(max_workers=TOKEN_REFRESH_WORKERS) as executor:
+                list(executor.map(refresh_user,spotify_ids))
+        logging.info(f"REFRESHED {len(spotify_ids)} OF {len(user_rows)} ACCESS TOKENS AHEAD OF THE RUN")
+        self.flush(conn)
 
-def define_spotify_objects(sp_oauth,refresh_token):
-    token_info = sp_oauth.refresh_access_token(refresh_token)
-    access_token = token_info['access_token']
-    return spotipy.Spotify(auth=access_token), access_token #spotify_helper_object(), access_token
+    def client(self,spotify_id,refresh_token):
+        self.track(spotify_id,refresh_token)
+        with self.lock:
+            if spotify_id in self.clients:
+                self.clients.move_to_end(spotify_id)
+                return self.clients[spotify_id]
+            self.clients[spotify_id] = spotipy.Spotify(auth_manager=UserAuthManager(self,spotify_id),requests_timeout=5)
+            while len(self.clients) > SPOTIFY_USER_CLIENTS:
+                self.clients.popitem(last=False)
+            return self.clients[spotify_id]
 
-def check_if_track_or_album_is_special(track,album_row,musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS):
-    album_id, release_type, release_date, artist_ids = album_row[0], album_row[1], handle_date(album_row[8]), set(album_row[10:69])
+    def flush(self,conn):
+        with self.lock:
+            pending, self.pending = list(self.pending.values()), {}
+        if len(pending) == 0:
+            return
+        with conn:
+            conn.executemany("UPDATE user SET access_token = ?,refresh_token = ?,token_expiry = ? WHERE spotify_id = ?",pending)
+        logging.info(f"WROTE {len(pending)} ACCESS TOKENS")
+
+def check_if_track_or_album_is_special(track,album,musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS):
+    album_id, release_type = album['id'], album['album_type']
     if release_type.lower() == 'compilation':
         return ids_related_to_user_for_today
-    artist_ids.discard("")
-    if album_id in musicbirthday_values['release_date']:
+    if len(album['artists']) > ALBUM_ARTIST_MATCH_LIMIT:
+        logging.warning(f"{album_id} | {len(album['artists'])} ARTISTS, ONLY MATCHING ON THE FIRST {ALBUM_ARTIST_MATCH_LIMIT}")
+    artist_ids = list(dict.fromkeys(artist['id'] for artist in album['artists'][:ALBUM_ARTIST_MATCH_LIMIT] if artist['id']))
+    release_date = handle_date(album['release_date'])
+    album_reason = match_reason(time_range,MatchKind.TRACK_ALBUM_RELEASE_DATE)
+    release_match = musicbirthday_values['release_date'].get(album_id)
+    if release_match is not None:
         if album_id not in ids_related_to_user_for_today:
             logging.info(f"{album_id} | {time_range} | {release_date} | ALBUM")
-            ids_related_to_user_for_today[album_id] = {'type':time_range+'_track_album_release_date','id_type':'album','id':album_id,'year':musicbirthday_values['release_date'][album_id]['date'].year}
+            ids_related_to_user_for_today[album_id] = Match(album_reason,'album',release_match.year)
         if track is not None and track['id'] not in ids_related_to_user_for_today:
             logging.info(f"{track['id']} | {time_range} | {release_date} | TRACK")
-            ids_related_to_user_for_today[track['id']] = {'type':time_range+'_track_album_release_date','id_type':'track','id':track['id'],'year':musicbirthday_values['release_date'][album_id]['date'].year}
+            ids_related_to_user_for_today[track['id']] = Match(album_reason,'track',release_match.year)
     for index, artist_id in enumerate(artist_ids):
-        if artist_id in musicbirthday_values['birthday']  and artist_id not in ids_related_to_user_for_today:
-            logging.info(f"{artist_id} | BIRTHDAY | {musicbirthday_values['birthday'][artist_id]['date']}")
-            ids_related_to_user_for_today[artist_id] = {'type':time_range+'_track_artist_birthday_'+ ('main' if index == 0 else 'support'),'id_type':'artist','id':artist_id,'year':musicbirthday_values['birthday'][artist_id]['date'].year,'band_member':musicbirthday_values['birthday'][artist_id]['band_member']}
-        if artist_id in musicbirthday_values['deathday'] and artist_id not in ids_related_to_user_for_today:
-            logging.info(f"{artist_id} | DEATHDAY | {musicbirthday_values['deathday'][artist_id]['date']}")
-            ids_related_to_user_for_today[artist_id] = {'type':time_range+'_track_artist_deathday_'+ ('main' if index == 0 else 'support'),'id_type':'artist','id':artist_id,'year':musicbirthday_values['deathday'][artist_id]['date'].year,'band_member':musicbirthday_values['deathday'][artist_id]['band_member']}
+        for occasion, main_kind, support_kind in (('birthday',MatchKind.TRACK_ARTIST_BIRTHDAY_MAIN,MatchKind.TRACK_ARTIST_BIRTHDAY_SUPPORT),('deathday',MatchKind.TRACK_ARTIST_DEATHDAY_MAIN,MatchKind.TRACK_ARTIST_DEATHDAY_SUPPORT)):
+            artist_match = musicbirthday_values[occasion].get(artist_id)
+            if artist_match is not None and artist_id not in ids_related_to_user_for_today:
+                logging.info(f"{artist_id} | {occasion.upper()} | {artist_match.year}")
+                ids_related_to_user_for_today[artist_id] = Match(match_reason(time_range,main_kind if index == 0 else support_kind),'artist',artist_match.year,artist_match.band_member)
     if release_date is not None and release_date.year <= MOST_RECENT_YEAR and release_date.month == month_to_match and release_date.day == day_to_match:
-        for index_ in range(10,70):
-            if str(album_row[index_])=='0LyfQWJT6nXafLPZqxe9Of':
-                break
-        else:
-            for skip_keyword in SKIP_KEYWORDS:
-                if skip_keyword in album_row[7]:
-                    break
-            else:
-                musicbirthday_values['release_date'][album_row[0]] = {'type':release_type,'date':release_date,'artist_ids':artist_ids}
-                if album_id not in ids_related_to_user_for_today:
-                    logging.info(f"{album_id} | {time_range} | {release_date} | ALBUM")
-                    ids_related_to_user_for_today[album_id] = {'type':time_range+'_track_album_release_date','id_type':'album','id':album_id,'year':release_date.year}
-                if track is not None and track['id'] not in ids_related_to_user_for_today:
-                    logging.info(f"{track['id']} | {time_range} | {release_date} | TRACK")
-                    ids_related_to_user_for_today[track['id']] = {'type':time_range+'_track_album_release_date','id_type':'track','id':track['id'],'year':release_date.year}
+        if any(artist['id'] == '0LyfQWJT6nXafLPZqxe9Of' for artist in album['artists'][:60]):
+            return ids_related_to_user_for_today
+        if any(skip_keyword in album['name'] for skip_keyword in SKIP_KEYWORDS):
+            return ids_related_to_user_for_today
+        musicbirthday_values['release_date'][album_id] = AlbumReleaseMatch(release_date.year,release_type,set(artist_ids))
+        if album_id not in ids_related_to_user_for_today:
+            logging.info(f"{album_id} | {time_range} | {release_date} | ALBUM")
+            ids_related_to_user_for_today[album_id] = Match(album_reason,'album',release_date.year)
+        if track is not None and track['id'] not in ids_related_to_user_for_today:
+            logging.info(f"{track['id']} | {time_range} | {release_date} | TRACK")
+            ids_related_to_user_for_today[track['id']] = Match(album_reason,'track',release_date.year)
     return ids_related_to_user_for_today
 
 def get_user_top_tracks(SPOTIFY_GET_LIMIT,time_range,TRACK_OFFSET,SLEEP_TIMER,sp):
@@ -344,454 +1490,1073 @@ def get_user_top_artists(SPOTIFY_GET_LIMIT,time_range,ARTIST_OFFSET,SLEEP_TIMER,
             time.sleep(SLEEP_TIMER * 5)
     return user_top_artists
 
-def get_artist_top_albums(artist,SPOTIFY_GET_LIMIT,ALBUM_OFFSET):
+def get_artist_top_albums(artist,SPOTIFY_GET_LIMIT,ALBUM_OFFSET,sp):
+    sub_albums_from_artist = spotify_cache_get('artist_albums',f"{artist['id']}|{ALBUM_OFFSET}|{SPOTIFY_GET_LIMIT}")
+    if sub_albums_from_artist is not None:
+        return sub_albums_from_artist
     while True:
         try:
+            rate_limit('spotify')
             sub_albums_from_artist = sp.artist_albums(artist['id'], include_groups='album,single,compilation,appears_on',limit=SPOTIFY_GET_LIMIT,offset=ALBUM_OFFSET)['items']                  
             break
         except Exception as e:
             logging.error(f"{e}")
             time.sleep(SLEEP_TIMER * 5)
+    spotify_cache_put_many('artist_albums',{f"{artist['id']}|{ALBUM_OFFSET}|{SPOTIFY_GET_LIMIT}":sub_albums_from_artist})
     return sub_albums_from_artist
 
-def write_album_id_to_csv(album_row,albums_already_written):
-    with open('albums.csv','a+',encoding='utf-8',newline='') as outfile:
-        csv.writer(outfile,delimiter=',').writerow(album_row)
-        logging.info(f"NEW ALBUM ROW {album_row}")
-    albums_already_written.add(album_id)
+def spotify_cache_get(endpoint,key):
+    with spotify_cache_lock:
+        cached = spotify_cache_memory.get((endpoint,key))
+        if cached is not None and cached[0] > time.time():
+            spotify_cache_memory.move_to_end((endpoint,key))
+            spotify_cache_stats[endpoint]['memory_hits'] += 1
+            count_event('spotify','cache_hits')
+            return cached[1]
+    row = http_cache_connection().execute("SELECT body,expires_at FROM spotify_cache WHERE endpoint = ? AND key = ? AND expires_at > ?",(endpoint,key,int(time.time()))).fetchone()
+    if row is None:
+        with spotify_cache_lock:
+            spotify_cache_stats[endpoint]['misses'] += 1
+        count_event('spotify','cache_misses')
+        return None
+    value = json.loads(zlib.decompress(row[0]))
+    remember_spotify_response(endpoint,key,value,row[1])
+    with spotify_cache_lock:
+        spotify_cache_stats[endpoint]['disk_hits'] += 1
+    count_event('spotify','cache_hits')
+    return value
+
+def remember_spotify_response(endpoint,key,value,expires_at):
+    with spotify_cache_lock:
+        spotify_cache_memory[(endpoint,key)] = (expires_at,value)
+        spotify_cache_memory.move_to_end((endpoint,key))
+        while len(spotify_cache_memory) > SPOTIFY_CACHE_MEMORY_ENTRIES:
+            spotify_cache_memory.popitem(last=False)
+
+def spotify_cache_put_many(endpoint,values):
+    expires_at = int(time.time() + SPOTIFY_CACHE_TTL_HOURS[endpoint]*60*60)
+    for key, value in values.items():
+        remember_spotify_response(endpoint,key,value,expires_at)
+    conn = http_cache_connection()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO spotify_cache (endpoint,key,body,expires_at) VALUES (?,?,?,?)",
+        ((endpoint,key,zlib.compress(json.dumps(value).encode('utf-8')),expires_at) for key, value in values.items()))
+
+def cached_spotify_batch(endpoint,ids,fetch_batch,batch_size):
+    found = {}
+    for id_ in dict.fromkeys(ids):
+        value = spotify_cache_get(endpoint,id_)
+        if value is not None:
+            found[id_] = value
+    missing = [id_ for id_ in dict.fromkeys(ids) if id_ not in found]
+    for index in range(0,len(missing),batch_size):
+        rate_limit('spotify')
+        fetched = {id_:value for id_, value in zip(missing[index:index+batch_size],fetch_batch(missing[index:index+batch_size])) if value is not None}
+        spotify_cache_put_many(endpoint,fetched)
+        found.update(fetched)
+    return [found[id_] for id_ in ids if id_ in found]
+
+def get_spotify_albums(sp,album_ids):
+    return cached_spotify_batch('album',album_ids,lambda ids: sp.albums(ids)['albums'],20)
+
+def get_spotify_tracks(sp,track_ids):
+    return cached_spotify_batch('track',track_ids,lambda ids: sp.tracks(ids,'US')['tracks'],50)
+
+def submit_spotify_batches(fetch,sp,ids,batch_size):
+    ids = list(dict.fromkeys(ids))
+    return [spotify_fetch_executor.submit(fetch,sp,ids[index:index+batch_size]) for index in range(0,len(ids),batch_size)]
+
+def get_artist_top_tracks(sp,artist_id):
+    tracks = spotify_cache_get('artist_top_tracks',artist_id)
+    if tracks is None:
+        rate_limit('spotify')
+        tracks = sp.artist_top_tracks(artist_id, country='US')['tracks']
+        spotify_cache_put_many('artist_top_tracks',{artist_id:tracks})
+    return tracks
+
+def log_spotify_cache_stats():
+    with spotify_cache_lock:
+        for endpoint, stats in spotify_cache_stats.items():
+            logging.info(f"SPOTIFY CACHE | {endpoint} | {stats['memory_hits']} MEMORY HITS | {stats['disk_hits']} DISK HITS | {stats['misses']} MISSES")
+
+def write_album_to_catalog(album,albums_already_written,conn):
+    if not claim_new_id(album['id'],albums_already_written):
+        return albums_already_written
+    queue_catalog_rows(conn,generate_album_catalog_rows(album))
+    logging.info(f"NEW ALBUM {album['id']} | {album['name']}")
     return albums_already_written
 
-def write_artist_id_to_csv(artist,artists_already_written,month_to_match, day_to_match,ids_related_to_user_for_today):
-    for artist_row in generate_artist_rows(artist):
-        with open('artists.csv','a+',encoding='utf-8',newline='') as outfile:
-            csv.writer(outfile,delimiter=',').writerow(artist_row)
-            logging.info(f"NEW ARTIST ROW {artist_row}")
-            artists_already_written.add(artist_row[0])
-            birthday, deathday = handle_date(artist_row[-4]), handle_date(artist_row[-3])
-            if birthday is not None and month_to_match == birthday.month and day_to_match == birthday.day:
-                ids_related_to_user_for_today[artist['id']] = {'type':time_range+'_artist_birthday_top','id_type':'artist','id':artist['id'],'year':birthday.year,'band_member':artist_row[-5]}
-            if deathday is not None and month_to_match == deathday.month and day_to_match == deathday.day:
-                ids_related_to_user_for_today[artist['id']] = {'type':time_range+'_artist_deathday_top','id_type':'artist','id':artist['id'],'year':deathday.year,'band_member':artist_row[-5]}
-    return artists_already_written,ids_related_to_user_for_today
+def write_artist_to_catalog(artist,artists_already_written,conn):
+    if not claim_new_id(artist['id'],artists_already_written):
+        return artists_already_written
+    queue_catalog_rows(conn,generate_artist_catalog_rows(artist,[]))
+    enqueue_artist_for_enrichment(conn,artist)
+    logging.info(f"NEW ARTIST {artist['id']} | {artist['name']}")
+    return artists_already_written
+
+def load_enrichment_queue(conn):
+    conn.executescript(ENRICHMENT_SCHEMA)
+    pending_count = conn.execute("SELECT count(*) FROM enrichment_queue WHERE status = 'pending'").fetchone()[0]
+    logging.info(f"FOUND {pending_count} ARTISTS WAITING FOR ENRICHMENT")
+
+def enqueue_artist_for_enrichment(conn,artist):
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO enrichment_queue (artist_id,artist_json,status,attempts,enqueued_at) VALUES (?,?,'pending',0,?)",
+        (artist['id'],json.dumps(artist),datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    enrichment_wakeup.set()
+
+def claim_next_artist_for_enrichment(conn):
+    now = datetime.now()
+    with conn:
+        recovered = conn.execute("UPDATE enrichment_queue SET status = 'pending' WHERE status = 'in_progress' AND enqueued_at <= ?",
+        ((now - timedelta(seconds=ENRICHMENT_CLAIM_TIMEOUT_SECONDS)).strftime('%Y-%m-%d %H:%M:%S'),)).rowcount
+    if recovered:
+        logging.warning(f"RECOVERED {recovered} ARTISTS CLAIMED FOR ENRICHMENT MORE THAN {ENRICHMENT_CLAIM_TIMEOUT_SECONDS} SECONDS AGO")
+    while True:
+        row = conn.execute("SELECT artist_id,artist_json,attempts FROM enrichment_queue WHERE status = 'pending' ORDER BY enqueued_at LIMIT 1").fetchone()
+        if row is None:
+            return None
+        with conn:
+            claimed = conn.execute("UPDATE enrichment_queue SET status = 'in_progress',enqueued_at = ? WHERE artist_id = ? AND status = 'pending'",
+            (now.strftime('%Y-%m-%d %H:%M:%S'),row[0])).rowcount
+        if claimed == 1:
+            return row
+
+def enrich_artist(conn,artist_id,artist_json,attempts):
+    artist = json.loads(artist_json)
+    try:
+        members = handle_birthday_deathday(artist)
+        queue_catalog_rows(conn,generate_artist_catalog_rows(artist,members))
+        flush_catalog_writes(conn)
+        with conn:
+            conn.execute("DELETE FROM enrichment_queue WHERE artist_id = ?",(artist_id,))
+        logging.info(f"ENRICHED ARTIST {artist_id} | {artist['name']} | {members}")
+    except Exception as e:
+        status = 'failed' if attempts + 1 >= ENRICHMENT_MAX_ATTEMPTS else 'pending'
+        logging.error(f"{artist_id} | {artist['name']} | {e} | {status.upper()}")
+        with conn:
+            conn.execute("UPDATE enrichment_queue SET status = ?,attempts = attempts + 1,last_error = ? WHERE artist_id = ?",(status,str(e),artist_id))
+
+def run_enrichment_worker():
+    with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+        while True:
+            row = claim_next_artist_for_enrichment(conn)
+            if row is None:
+                enrichment_wakeup.wait(60)
+                enrichment_wakeup.clear()
+                continue
+            with timed_stage('enrichment'):
+                enrich_artist(conn,*row)
+
+def start_enrichment_workers(worker_count):
+    for worker_index in range(worker_count):
+        threading.Thread(target=run_enrichment_worker,name=f'enrichment_{worker_index}',daemon=True).start()
 
 def check_if_artist_is_special(artist,musicbirthday_values,ids_related_to_user_for_today,time_range):
-    if artist['id'] in musicbirthday_values['birthday'] and artist['id'] not in ids_related_to_user_for_today:
-        logging.info(f"{artist['id']} | BIRTHDAY | {musicbirthday_values['birthday'][artist['id']]['date']}")
-        ids_related_to_user_for_today[artist['id']] = {'type':time_range+'_artist_birthday_top','id_type':'artist','id':artist['id'],'year':musicbirthday_values['birthday'][artist['id']]['date'].year,'band_member':musicbirthday_values['birthday'][artist['id']]['band_member']}
-    if artist['id'] in musicbirthday_values['deathday'] and artist['id'] not in ids_related_to_user_for_today:
-        logging.info(f"{artist['id']} | DEATHDAY | {musicbirthday_values['deathday'][artist['id']]['date']}")
-        ids_related_to_user_for_today[artist['id']] = {'type':time_range+'_artist_deathday_top','id_type':'artist','id':artist['id'],'year':musicbirthday_values['deathday'][artist['id']]['date'].year,'band_member':musicbirthday_values['deathday`'][artist['id']]['band_member']}
+    for occasion, kind in (('birthday',MatchKind.ARTIST_BIRTHDAY_TOP),('deathday',MatchKind.ARTIST_DEATHDAY_TOP)):
+        artist_match = musicbirthday_values[occasion].get(artist['id'])
+        if artist_match is not None and artist['id'] not in ids_related_to_user_for_today:
+            logging.info(f"{artist['id']} | {occasion.upper()} | {artist_match.year}")
+            ids_related_to_user_for_today[artist['id']] = Match(match_reason(time_range,kind),'artist',artist_match.year,artist_match.band_member)
     return ids_related_to_user_for_today
 
-def get_track_playcount(track_playcount,track_artist,track):
+def get_lastfm_playcount(artist_name,track_name):
     try:
-        track_playcount += int(requests.get("http://ws.audioscrobbler.com/2.0/",timeout = 3,
+        track_playcount = int(http_get(f"{HTTP_BASE_URLS['lastfm']}/2.0/",
         params = {
         'method': 'track.getInfo',
         'api_key': LAST_FM_API_KEY,
-        'artist': track_artist['name'],
-        'track': track['name'],
+        'artist': artist_name,
+        'track': track_name,
         'format': 'json'}).json()['track']['playcount'])
-        logging.info(f"{track_artist['name'] } {track['name']} | {track_playcount}")
+        logging.info(f"{artist_name} {track_name} | {track_playcount}")
+        return track_playcount
+    except Exception as e:
+        logging.error(f"{artist_name} | {track_name} | {e}")
+        return 0
+
+def track_playcount_pairs(track):
+    return [(track_artist['name'],track['name']) for track_artist in track['artists']]
+
+def forget_lastfm_fetch(pair):
+    with lastfm_lock:
+        lastfm_fetches_in_flight.pop(pair,None)
+
+def fetch_lastfm_playcounts(pairs):
+    futures = {}
+    with lastfm_lock:
+        for pair in pairs:
+            if pair in lastfm_fetches_in_flight:
+                futures[pair] = lastfm_fetches_in_flight[pair]
+                continue
+            futures[pair] = lastfm_fetches_in_flight[pair] = lastfm_executor.submit(get_lastfm_playcount,*pair)
+            futures[pair].add_done_callback(lambda future, pair=pair: forget_lastfm_fetch(pair))
+    return {pair:future.result() for pair, future in futures.items()}
+
+def store_track_playcounts(conn,track_playcounts):
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO track_playcounts (track_id,playcount,fetched_at) VALUES (?,?,?)",((track_id,track_playcount,int(time.time())) for track_id, track_playcount in track_playcounts.items()))
+
+def refresh_track_playcounts(tracks):
+    try:
+        fetched = fetch_lastfm_playcounts({pair for track in tracks for pair in track_playcount_pairs(track)})
+        with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+            store_track_playcounts(conn,{track['id']:sum(fetched[pair] for pair in track_playcount_pairs(track)) for track in tracks})
+        logging.info(f"REFRESHED {len(tracks)} STALE TRACK COUNTS")
     except Exception as e:
         logging.error(f"{e}")
-    return track_playcount
-
-def update_tracks_to_consider_with_info(track,values,track_playcount,album,tracks_to_consider):
-    tracks_to_consider[track['id']] = {
-        'type': values['type'],
-        'track_playcount': track_playcount,
-        'id_type': values['id_type'],
-        'artists':track['artists'],
-        'album_label':album.get('label',None),
-        'album_popularity':album.get('popularity',0),
-        'track_popularity':0,
-        'track_duration_ms':track['duration_ms'],
-        'score':0,
-        'year':values['year'],
-        'band_member':values.get('band_member','')
-    }
+    finally:
+        with lastfm_lock:
+            playcounts_refreshing.difference_update(track['id'] for track in tracks)
+
+def refresh_stale_playcounts(tracks):
+    with lastfm_lock:
+        tracks = [track for track in tracks if track['id'] not in playcounts_refreshing]
+        playcounts_refreshing.update(track['id'] for track in tracks)
+    if tracks:
+        playcount_refresh_executor.submit(refresh_track_playcounts,tracks)
+
+def prefetch_track_playcounts(conn,tracks):
+    tracks = {track['id']:track for track in tracks}
+    track_ids, cached = list(tracks), {}
+    for index in range(0,len(track_ids),500):
+        track_ids_chunk = track_ids[index:index+500]
+        cached.update({track_id:(track_playcount,fetched_at) for track_id, track_playcount, fetched_at in conn.execute(f"SELECT track_id,playcount,fetched_at FROM track_playcounts WHERE track_id IN ({','.join('?'*len(track_ids_chunk))})",track_ids_chunk)})
+    to_return = {track_id:track_playcount for track_id, (track_playcount,fetched_at) in cached.items()}
+    missing = [track for track_id, track in tracks.items() if track_id not in cached]
+    stale_before = time.time() - PLAYCOUNT_TTL_DAYS*24*60*60
+    stale = [tracks[track_id] for track_id, (track_playcount,fetched_at) in cached.items() if fetched_at < stale_before]
+    if len(missing) > 0:
+        fetched = fetch_lastfm_playcounts({pair for track in missing for pair in track_playcount_pairs(track)})
+        new_playcounts = {track['id']:sum(fetched[pair] for pair in track_playcount_pairs(track)) for track in missing}
+        store_track_playcounts(conn,new_playcounts)
+        to_return.update(new_playcounts)
+    if len(stale) > 0:
+        refresh_stale_playcounts(stale)
+    count_event('lastfm','cache_hits',len(cached))
+    count_event('lastfm','cache_misses',len(missing))
+    logging.info(f"TRACK COUNTS | {len(tracks)} TRACKS | {len(cached)} CACHED | {len(missing)} FETCHED | {len(stale)} STALE")
+    return to_return
+
+def update_tracks_to_consider_with_info(track,values,track_playcount,tracks_to_consider,popularity=0):
+    candidate = Candidate()
+    candidate.reason, candidate.id_type, candidate.year, candidate.band_member = values.reason, values.id_type, values.year, values.band_member
+    candidate.track_name, candidate.popularity, candidate.track_playcount, candidate.track_duration_ms = track['name'], popularity, track_playcount, track['duration_ms']
+    candidate.artist_ids, candidate.artist_names = tuple(artist['id'] for artist in track['artists']), tuple(artist['name'] for artist in track['artists'])
+    candidate.score, candidate.full_track_name = 0, None
+    tracks_to_consider[track['id']] = candidate
     return tracks_to_consider
 
-def translate_type_to_english(type_match,year,band_member_name):
-    if type_match.endswith('_album_release_date') or type_match.endswith('release_date_top_album'):
+def translate_type_to_english(reason,year,band_member_name):
+    occasion = reason_occasion(reason)
+    if occasion == Occasion.RELEASE_DATE:
         return f'was released on this date in {year}'
-    elif '_birthday_' in type_match:
+    elif occasion == Occasion.BIRTHDAY:
         return f'has artist {band_member_name} celebrating a birthday today! They were born in {year}'
-    elif '_deathday_' in type_match:
+    elif occasion == Occasion.DEATHDAY:
         return f'has artist {band_member_name} who passed away on this date in {year}'
 
-def get_track_scores(tracks_to_consider):
-    for track_id,values_ in tqdm(tracks_to_consider.items()):
-        track_score = 0
-        if int(values_['track_duration_ms']) < 90000 or int(values_['track_duration_ms']) > 600000:
-            logging.warning(f"{track_id} | SKIPPING ({round(values_['track_duration_ms']/60000,2)} MINUTES)")
-            continue
-        if int(values_['year']) in SKIP_YEARS_DUE_TO_BEING_TOO_RECENT:
-            logging.warning(f"{track_id} | SKIPPING BECAUSE TOO RECENT {values_[year]}")
-            continue
-        if values_['id_type'] == 'track':
-            track_score += 6
-        elif (values_['id_type'] == 'album' and '_artist_' in values_['type']) or values_['id_type'] == 'artist':
-            track_score += 3
-        else:
-            logging.warning(f"{track_id} | SKIPPING BECAUSE JUST ALBUM RELEASE DATE")
-            continue
-        if values_['type'].startswith('short'):
-            track_score += 5
-        elif values_['type'].startswith('medium'):
-            track_score += 3
-        elif values_['type'].startswith('long'):
-            track_score += 1
-        track_year_score_multipier = 0 
-        temp, temp_diff = min(int(year__) for year__ in SKIP_YEARS_DUE_TO_BEING_TOO_RECENT) - int(values_['year']), 5
-        while temp > 0:
-            temp -= temp_diff
-            track_year_score_multipier += 1
-        track_score += track_year_score_multipier
-        playcount_thresholds = [1000,10000,50000,100000,250000,500000,1000000,2000000,3000000,4000000,5000000,10000000,25000000,50000000,100000000,1000000000,999999999999]
-        playcount_thresholds_index = 0
-        while int(values_['track_playcount']) > playcount_thresholds[playcount_thresholds_index]:
-            playcount_thresholds_index += 1
-        track_score += playcount_thresholds_index / 1.2
-        track_score += float(max(values_['album_popularity'],values_['track_popularity']))/50
-        logging.info(f"{track_id} | {track_score}")
-        tracks_to_consider[track_id]['score'] = track_score
+def get_track_scores(tracks_to_consider,scoring_weights=SCORING_WEIGHTS):
+    track_ids = list(tracks_to_consider.keys())
+    if len(track_ids) == 0:
+        return tracks_to_consider
+    rows = [tracks_to_consider[track_id] for track_id in track_ids]
+    durations = np.fromiter((int(row.track_duration_ms) for row in rows),dtype=np.int64,count=len(rows))
+    years = np.fromiter((int(row.year) for row in rows),dtype=np.int64,count=len(rows))
+    playcounts = np.fromiter((int(row.track_playcount) for row in rows),dtype=np.int64,count=len(rows))
+    reasons = np.fromiter((row.reason for row in rows),dtype=np.int64,count=len(rows))
+    id_types = np.fromiter((ID_TYPE_CODES[row.id_type] for row in rows),dtype=np.int64,count=len(rows))
+    id_type_scores = np.select([id_types == ID_TYPE_CODES['track'],id_types == ID_TYPE_CODES['artist'],(id_types == ID_TYPE_CODES['album']) & ((reasons & 7) != MatchKind.TRACK_ALBUM_RELEASE_DATE)],
+                               [scoring_weights['id_type']['track'],scoring_weights['id_type']['artist'],scoring_weights['id_type']['artist_album']],-1)
+    time_range_scores = np.array([scoring_weights['time_range'].get(time_range,0) for time_range in TIME_RANGES],dtype=np.int64)[reasons >> 3]
+    duration_ok = (durations >= scoring_weights['min_duration_ms']) & (durations <= scoring_weights['max_duration_ms'])
+    recent_year_cutoff = min(int(year__) for year__ in SKIP_YEARS_DUE_TO_BEING_TOO_RECENT)
+    recency_ok = ~np.isin(years,[int(year__) for year__ in SKIP_YEARS_DUE_TO_BEING_TOO_RECENT]) if scoring_weights['skip_recent_years'] else np.ones(len(rows),dtype=bool)
+    id_type_ok = id_type_scores >= 0
+    year_scores = -(-np.maximum(recent_year_cutoff - years,0) // scoring_weights['year_bucket_size'])
+    playcount_scores = np.searchsorted(np.array(scoring_weights['playcount_thresholds'],dtype=np.int64),playcounts,side='left') / scoring_weights['playcount_divisor']
+    scores = (id_type_scores + time_range_scores + year_scores) + playcount_scores
+    scored = duration_ok & recency_ok & id_type_ok
+    for index in np.flatnonzero(scored):
+        tracks_to_consider[track_ids[index]].score = float(scores[index])
+    logging.info(f"SCORED {int(scored.sum())} OF {len(track_ids)} TRACKS | {int((~duration_ok).sum())} SKIPPED FOR DURATION | {int((duration_ok & ~recency_ok).sum())} SKIPPED BECAUSE TOO RECENT | {int((duration_ok & recency_ok & ~id_type_ok).sum())} SKIPPED BECAUSE JUST ALBUM RELEASE DATE")
     return tracks_to_consider
 
-def get_track_ids_to_add_to_playlist(tracks_to_consider, sp, ARTIST_ID_TRACK_LIMIT = 1, TRACK_SCORE_MIN = 3):
+def select_track_ids_for_playlist(tracks_to_consider_for_real, reasons_in_english, ARTIST_ID_TRACK_LIMIT = 1, TRACK_SCORE_MIN = 3):
+    track_ids_to_add_to_playlist, artist_id_track_id_count, retired_positions = [], {}, set()
+    id_count_allowed_left = [0]*len(Occasion)
+    id_count_allowed_left[Occasion.BIRTHDAY], id_count_allowed_left[Occasion.DEATHDAY], id_count_allowed_left[Occasion.RELEASE_DATE] = 16, 4, 30
+    candidates = list(tracks_to_consider_for_real.items())
+    lookup_keys = [MATCH_KIND_OCCASIONS[values__.reason & 7] for track_id, values__ in candidates]
+    positions_by_score = sorted(range(len(candidates)),key=lambda position: candidates[position][1].score,reverse=True)
+    while len(track_ids_to_add_to_playlist) < MAX_PLAYLIST_LENGTH:
+        if ARTIST_ID_TRACK_LIMIT >= 50:
+            break
+        TRACK_SCORE_MAX, live_positions, admitted = 20, [], 0
+        while TRACK_SCORE_MAX > TRACK_SCORE_MIN:
+            while admitted < len(positions_by_score) and candidates[positions_by_score[admitted]][1].score >= TRACK_SCORE_MAX:
+                if positions_by_score[admitted] not in retired_positions:
+                    bisect.insort(live_positions,positions_by_score[admitted])
+                admitted += 1
+            still_live_positions = []
+            for position in live_positions:
+                track_id, values__ = candidates[position]
+                lookup_key = lookup_keys[position]
+                if id_count_allowed_left[lookup_key] == 0:
+                    retired_positions.add(position)
+                    continue
+                for artist_id in values__.artist_ids:
+                    if artist_id_track_id_count.get(artist_id,0) >= ARTIST_ID_TRACK_LIMIT:
+                        break
+                    artist_id_track_id_count[artist_id] = artist_id_track_id_count.get(artist_id,0) + 1
+                else:
+                    logging.info(f"ADDING {track_id} | {values__.year} | {reason_name(values__.reason)} | {values__.track_playcount} | {values__.id_type} | {values__.artist_ids} | {values__.track_duration_ms} | {values__.score} | {values__.band_member}")
+                    track_ids_to_add_to_playlist.append(track_id)
+                    retired_positions.add(position)
+                    id_count_allowed_left[lookup_key] -= 1
+                    reasons_in_english[track_id] = '<p>' + values__.full_track_name + ' ' + translate_type_to_english(values__.reason,values__.year,values__.band_member) + '</p>'
+                    if len(track_ids_to_add_to_playlist) == MAX_PLAYLIST_LENGTH:
+                        return track_ids_to_add_to_playlist
+                    continue
+                still_live_positions.append(position)
+            live_positions = still_live_positions
+            TRACK_SCORE_MAX -= 1
+        ARTIST_ID_TRACK_LIMIT += 1
+    return track_ids_to_add_to_playlist
+
+def get_track_ids_to_add_to_playlist(tracks_to_consider, ARTIST_ID_TRACK_LIMIT = 1, TRACK_SCORE_MIN = 3, seed = None):
     reasons_in_english = {}
     try:
         track_ids_to_add_to_playlist, artist_id_track_id_count, tracks_to_consider_after_looking_at_artist_name_and_track_name, tracks_to_consider_for_real = [], {}, {}, {}
-        tracks_to_consider_keys = list(tracks_to_consider.copy().keys())
-        while len(tracks_to_consider_keys)>50:
-            for index, possible_track in tqdm(enumerate(sp.tracks(tracks_to_consider_keys[:50],'US')['tracks'])):
-                track_name, track_popularity = possible_track['name']+' by '+', '.join(_['name'] for _ in possible_track['artists']), possible_track['popularity']
-                logging.info(f"{track_name} | {track_popularity}")
-                if track_name in tracks_to_consider_after_looking_at_artist_name_and_track_name:
-                    if tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name]['popularity'] < possible_track['popularity']:
-                        del tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name]
-                        tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':possible_track['id'],'popularity':possible_track['popularity'],'track_data':tracks_to_consider[possible_track['id']]}
-                        logging.info(f"UPDATED TRACK {track_name} WITH NEW POPULARITY / ID | {possible_track['id']} ({possible_track['popularity']})")
-                    else:
-                        logging.info('SKIPPED A TRACK BECAUSE SAME ARTIST AND TRACK NAME')
-                else:
-                    tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':possible_track['id'],'popularity':possible_track['popularity'],'track_data':tracks_to_consider[possible_track['id']]}
-                    logging.info(f"NEW TRACK {track_name} | {possible_track['id']} ({possible_track['popularity']})")
-            tracks_to_consider_keys = tracks_to_consider_keys[50:]
-        for index, possible_track in tqdm(enumerate(sp.tracks(tracks_to_consider_keys,'US')['tracks'])):
-            track_name, track_popularity = possible_track['name']+' by '+', '.join(_['name'] for _ in possible_track['artists']), possible_track['popularity']
+        for track_id, values__ in tqdm(tracks_to_consider.items()):
+            track_name, track_popularity = values__.track_name+' by '+', '.join(values__.artist_names), values__.popularity
             logging.info(f"{track_name} | {track_popularity}")
             if track_name in tracks_to_consider_after_looking_at_artist_name_and_track_name:
-                if tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name]['popularity'] < possible_track['popularity']:
+                if tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name]['popularity'] < track_popularity:
                     del tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name]
-                    tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':possible_track['id'],'popularity':possible_track['popularity'],'track_data':tracks_to_consider[possible_track['id']]}
-                    logging.info(f"UPDATED TRACK {track_name} WITH NEW POPULARITY / ID | {possible_track['id']} ({possible_track['popularity']})")
+                    tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':track_id,'popularity':track_popularity,'track_data':values__}
+                    logging.info(f"UPDATED TRACK {track_name} WITH NEW POPULARITY / ID | {track_id} ({track_popularity})")
                 else:
                     logging.info('SKIPPED A TRACK BECAUSE SAME ARTIST AND TRACK NAME')
             else:
-                tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':possible_track['id'],'popularity':possible_track['popularity'],'track_data':tracks_to_consider[possible_track['id']]}
-                logging.info(f"NEW TRACK {track_name} | {possible_track['id']} ({possible_track['popularity']})")
+                tracks_to_consider_after_looking_at_artist_name_and_track_name[track_name] = {'id':track_id,'popularity':track_popularity,'track_data':values__}
+                logging.info(f"NEW TRACK {track_name} | {track_id} ({track_popularity})")
         for full_track_name,track in tracks_to_consider_after_looking_at_artist_name_and_track_name.items():
             tracks_to_consider_for_real[track['id']] = track['track_data']
-            tracks_to_consider_for_real[track['id']]['full_track_name'] = full_track_name
-        id_count_allowed_left = {
-        'birthday':16,
-        'deathday':4,
-        'release_date':30
-        }
-        while len(track_ids_to_add_to_playlist) < MAX_PLAYLIST_LENGTH:
-            if ARTIST_ID_TRACK_LIMIT >= 50:
-                break
-            TRACK_SCORE_MAX = 20
-            while TRACK_SCORE_MAX > TRACK_SCORE_MIN:
-                for track_id, values__ in tracks_to_consider_for_real.items():
-                    if track_id in track_ids_to_add_to_playlist:
-                        continue
-                    lookup_key = None
-                    for key in id_count_allowed_left:
-                        if key in values__['type']:
-                            lookup_key = key
-                            break
-                    if id_count_allowed_left[lookup_key] == 0:
-                        continue
-                    if values__['score'] < TRACK_SCORE_MAX:
-                        continue
-                    for artist_id in values__['artists']:
-                        artist_id = artist_id['id']
-                        if artist_id in artist_id_track_id_count and artist_id_track_id_count.get(artist_id,0) >= ARTIST_ID_TRACK_LIMIT:
-                            break
-                        if artist_id not in artist_id_track_id_count:
-                            artist_id_track_id_count[artist_id] = 0
-                        artist_id_track_id_count[artist_id] += 1
-                    else:
-                        logging.info(f"ADDING {track_id} | {values__['year']} | {values__['type']} | {values__['track_playcount']} | {values__['id_type']} | {values__['artists']} | {values__['track_duration_ms']} | {values__['score']} | {values__.get('band_member','')}")
-                        track_ids_to_add_to_playlist.append(track_id)
-                        id_count_allowed_left[lookup_key] -= 1
-                        reasons_in_english[track_id] = '<p>' + values__['full_track_name'] + ' ' + translate_type_to_english(values__['type'],values__['year'],values__.get('band_member','')) + '</p>'
-                        if len(track_ids_to_add_to_playlist) == MAX_PLAYLIST_LENGTH:
-                            break
-                    if len(track_ids_to_add_to_playlist) == MAX_PLAYLIST_LENGTH:
-                        break
-                if len(track_ids_to_add_to_playlist) == MAX_PLAYLIST_LENGTH:
-                    break
-                TRACK_SCORE_MAX -= 1
-            ARTIST_ID_TRACK_LIMIT += 1
+            tracks_to_consider_for_real[track['id']].full_track_name = full_track_name
+        track_ids_to_add_to_playlist = select_track_ids_for_playlist(tracks_to_consider_for_real,reasons_in_english,ARTIST_ID_TRACK_LIMIT,TRACK_SCORE_MIN)
         logging.info("Finished adding stuff to playlist, shuffling...")
-        random.shuffle(track_ids_to_add_to_playlist)
-        random.shuffle(track_ids_to_add_to_playlist)
+        shuffler = random if seed is None else random.Random(seed)
+        shuffler.shuffle(track_ids_to_add_to_playlist)
+        shuffler.shuffle(track_ids_to_add_to_playlist)
         logging.info("...shuffled!")
-        reasons_in_english_text = """"""
-        for track_id in track_ids_to_add_to_playlist:
-            reasons_in_english_text += reasons_in_english[track_id]
     except Exception as e:
         logging.critical(f"{e}")
-    return track_ids_to_add_to_playlist,reasons_in_english_text
+    return track_ids_to_add_to_playlist,reasons_in_english
+
+def join_reasons(reasons_in_english,track_ids):
+    return ''.join(reasons_in_english[track_id] for track_id in track_ids)
 
-def send_email(user_email,playlist_id,reasons_in_english_text):
+def render_email(user_email,playlist_id,reasons_in_english_text,day):
     msg = MIMEMultipart()
-    msg['From'], msg['To'], msg['Subject'] = "Music Birthday <support@musicbirthday.com>", user_email, f"Your Music Birthday Playlist for {datetime.today().strftime('%B %d')} is here!"
-    msg.attach(MIMEText(f"""<html><h1>{datetime.today().strftime('%B %d')}</h1>
+    msg['From'], msg['To'], msg['Subject'] = SMTP_FROM, user_email, f"Your Music Birthday Playlist for {day.strftime('%B %d')} is here!"
+    msg.attach(MIMEText(f"""<html><h1>{day.strftime('%B %d')}</h1>
     <br><div class="description">See below for a copy of your <strong><a href="https://musicbirthday.com">MusicBirthday.com</a></strong> playlist!</div>
     <p><a href="https://open.spotify.com/playlist/{playlist_id}" style="color: #1DB954;">Open in Spotify</a></p>
     <div class="description">Questions? Issues? Reach out to <strong><a href="mailto:support@musicbirthday.com">support@musicbirthday.com</a></strong></div>
     <div class="description">{reasons_in_english_text}</div></html>""", 'html'))
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.send_message(msg)
-
-def get_cached_playcounts():
-    to_return = {}
-    with open('track_playcounts.tsv','r',encoding='utf-8') as infile:
-        for line in infile.read().splitlines():
-            to_return[line.split('\t')[0]] = int(line.split('\t')[1])
-    return to_return
+    return msg
+
+def send_email(conn,user_email,playlist_id,reasons_in_english_text,day):
+    now = int(time.time())
+    with conn:
+        conn.execute("INSERT INTO email_outbox (recipient,message,status,attempts,next_attempt_at,enqueued_at) VALUES (?,?,'pending',0,?,?)",
+        (user_email,render_email(user_email,playlist_id,reasons_in_english_text,day).as_string(),now,now))
+    email_wakeup.set()
+
+def load_email_outbox(conn):
+    conn.executescript(EMAIL_OUTBOX_SCHEMA)
+    pending_count = conn.execute("SELECT count(*) FROM email_outbox WHERE status = 'pending'").fetchone()[0]
+    logging.info(f"FOUND {pending_count} EMAILS WAITING TO BE SENT")
+
+def claim_next_email(conn):
+    now = int(time.time())
+    with conn:
+        recovered = conn.execute("UPDATE email_outbox SET status = 'pending' WHERE status = 'sending' AND next_attempt_at <= ?",(now,)).rowcount
+    if recovered:
+        logging.warning(f"RECOVERED {recovered} EMAILS CLAIMED MORE THAN {EMAIL_CLAIM_TIMEOUT_SECONDS} SECONDS AGO")
+    while True:
+        row = conn.execute("SELECT id,recipient,message,attempts FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",(now,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            claimed = conn.execute("UPDATE email_outbox SET status = 'sending',next_attempt_at = ? WHERE id = ? AND status = 'pending'",(now + EMAIL_CLAIM_TIMEOUT_SECONDS,row[0])).rowcount
+        if claimed == 1:
+            return row
+
+def seconds_until_next_email(conn):
+    next_attempt_at = conn.execute("SELECT min(next_attempt_at) FROM email_outbox WHERE status IN ('pending','sending')").fetchone()[0]
+    return 60 if next_attempt_at is None else min(max(next_attempt_at - time.time(),0),60)
+
+class SmtpConnection:
+    def __init__(self):
+        self.server, self.last_used = None, 0
+
+    def connect(self):
+        self.close()
+        self.server = smtplib.SMTP(SMTP_SERVER,SMTP_PORT,timeout=SMTP_TIMEOUT_SECONDS)
+        if SMTP_STARTTLS:
+            self.server.starttls()
+        if SMTP_USERNAME:
+            self.server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        count_event('smtp','connects')
+        logging.info(f"CONNECTED TO {SMTP_SERVER}:{SMTP_PORT}")
+
+    def send(self,recipient,message):
+        if self.server is None or time.time() - self.last_used > SMTP_IDLE_SECONDS:
+            self.connect()
+        try:
+            self.server.sendmail(SMTP_FROM,[recipient],message)
+        except (smtplib.SMTPServerDisconnected,ConnectionError):
+            self.connect()
+            self.server.sendmail(SMTP_FROM,[recipient],message)
+        self.last_used = time.time()
+
+    def close_if_idle(self):
+        if self.server is not None and time.time() - self.last_used > SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+def deliver_email(conn,smtp_connection,email_id,recipient,message,attempts):
+    try:
+        rate_limit('smtp')
+        with timed_stage('email_send'):
+            smtp_connection.send(recipient,message)
+        with conn:
+            conn.execute("UPDATE email_outbox SET status = 'sent',attempts = attempts + 1,sent_at = ? WHERE id = ?",(int(time.time()),email_id))
+        logging.info(f"EMAIL {email_id} | {recipient} | SENT")
+    except Exception as e:
+        smtp_connection.close()
+        permanent = isinstance(e,(smtplib.SMTPRecipientsRefused,smtplib.SMTPSenderRefused)) or attempts + 1 >= EMAIL_MAX_ATTEMPTS
+        status, next_attempt_at = ('failed' if permanent else 'pending'), int(time.time() + EMAIL_BACKOFF_SECONDS*2**attempts)
+        count_event('smtp','errors')
+        logging.error(f"EMAIL {email_id} | {recipient} | {e} | {status.upper()}")
+        with conn:
+            conn.execute("UPDATE email_outbox SET status = ?,attempts = attempts + 1,last_error = ?,next_attempt_at = ? WHERE id = ?",(status,str(e),next_attempt_at,email_id))
+
+def run_email_sender():
+    smtp_connection = SmtpConnection()
+    with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+        while True:
+            row = claim_next_email(conn)
+            if row is None:
+                smtp_connection.close_if_idle()
+                email_wakeup.wait(seconds_until_next_email(conn))
+                email_wakeup.clear()
+                continue
+            deliver_email(conn,smtp_connection,*row)
+
+def start_email_sender():
+    threading.Thread(target=run_email_sender,name='email_sender',daemon=True).start()
+
+def wait_for_email_outbox(conn,timeout=EMAIL_DRAIN_SECONDS):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if conn.execute("SELECT count(*) FROM email_outbox WHERE status = 'sending' OR (status = 'pending' AND next_attempt_at <= ?)",(int(time.time()),)).fetchone()[0] == 0:
+            return True
+        time.sleep(0.5)
+    logging.warning(f"EMAIL OUTBOX NOT EMPTY AFTER {timeout} SECONDS")
+    return False
+
+def load_playcount_cache(conn):
+    conn.executescript(PLAYCOUNT_SCHEMA)
+    if conn.execute("SELECT count(*) FROM track_playcounts").fetchone()[0] == 0 and os.path.exists('track_playcounts.tsv'):
+        with open('track_playcounts.tsv','r',encoding='utf-8') as infile:
+            rows = [line.split('\t') for line in infile.read().splitlines() if line]
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO track_playcounts (track_id,playcount,fetched_at) VALUES (?,?,?)",((row[0],int(row[1]),int(time.time())) for row in rows))
+        logging.info(f"Imported {len(rows)} track counts from 'track_playcounts.tsv'")
+
+def new_daily_candidate_pool(day):
+    return {'day':day,'album':{},'artist':{},'tracks':{}}
+
+def add_to_daily_candidate_pool(daily_candidate_pool,source_id,id_type,track,track_playcount,popularity):
+    daily_candidate_pool[id_type].setdefault(source_id,[]).append(track['id'])
+    daily_candidate_pool['tracks'][track['id']] = {'track':track,'track_playcount':track_playcount,'popularity':popularity}
+
+def build_daily_candidate_pool(conn,sp,musicbirthday_values,day):
+    logging.info(f"Building candidate pool for {day}")
+    daily_candidate_pool, candidate_sources = new_daily_candidate_pool(day), []
+    for album in tqdm(get_spotify_albums(sp,list(musicbirthday_values['release_date']))):
+        for track in album['tracks']['items']:
+            candidate_sources.append((album['id'],'album','release_date',musicbirthday_values['release_date'][album['id']],track))
+    for reason in ('birthday','deathday'):
+        for artist_id, values in tqdm(musicbirthday_values[reason].items()):
+            for track in get_artist_top_tracks(sp,artist_id):
+                candidate_sources.append((artist_id,'artist',reason,values,track))
+    popularities = {track['id']:track['popularity'] for track in get_spotify_tracks(sp,list({candidate[4]['id'] for candidate in candidate_sources if 'popularity' not in candidate[4]}))}
+    track_playcounts = prefetch_track_playcounts(conn,[candidate[4] for candidate in candidate_sources])
+    rows = []
+    for source_id, id_type, reason, values, track in candidate_sources:
+        track = {'id':track['id'],'name':track['name'],'artists':[{'id':artist['id'],'name':artist['name']} for artist in track['artists']],'duration_ms':track['duration_ms']}
+        popularity = popularities.get(track['id'],track.get('popularity',0))
+        add_to_daily_candidate_pool(daily_candidate_pool,source_id,id_type,track,track_playcounts.get(track['id'],0),popularity)
+        rows.append((day,source_id,track['id'],id_type,reason,values.year,'' if reason == 'release_date' else values.band_member,track_playcounts.get(track['id'],0),popularity,track['duration_ms'],json.dumps(track)))
+    with conn:
+        conn.execute("DELETE FROM daily_candidates WHERE day < date(?,?) OR day > date(?,?)",(day,f"-{MATCH_DAYS_BEFORE+MATCH_DAYS_AFTER} day",day,f"+{MATCH_DAYS_BEFORE+MATCH_DAYS_AFTER} day"))
+        conn.executemany("INSERT OR REPLACE INTO daily_candidates (day,source_id,track_id,id_type,reason,year,band_member,playcount,popularity,duration_ms,track_json) VALUES (?,?,?,?,?,?,?,?,?,?,?)",rows)
+    logging.info(f"Built candidate pool for {day} | {len(daily_candidate_pool['album'])} ALBUMS | {len(daily_candidate_pool['artist'])} ARTISTS | {len(daily_candidate_pool['tracks'])} TRACKS")
+    return daily_candidate_pool
+
+def load_daily_candidate_pool(conn,musicbirthday_values,day,daily_candidate_pool=None,retry=True):
+    if daily_candidate_pool is not None and daily_candidate_pool['day'] == day and not (retry and daily_candidate_pool.get('failed')):
+        return daily_candidate_pool
+    conn.executescript(CANDIDATE_POOL_SCHEMA)
+    rows = conn.execute("SELECT source_id,id_type,playcount,popularity,track_json FROM daily_candidates WHERE day = ?",(day,)).fetchall()
+    if len(rows) == 0:
+        try:
+            return build_daily_candidate_pool(conn,spotify_catalog_object(),musicbirthday_values,day)
+        except Exception as e:
+            logging.error(f"CANDIDATE POOL FOR {day} FAILED | {e} | HYDRATING PER USER UNTIL THE NEXT RETRY")
+            daily_candidate_pool = new_daily_candidate_pool(day)
+            daily_candidate_pool['failed'] = True
+            return daily_candidate_pool
+    daily_candidate_pool = new_daily_candidate_pool(day)
+    for source_id, id_type, track_playcount, popularity, track_json in rows:
+        add_to_daily_candidate_pool(daily_candidate_pool,source_id,id_type,json.loads(track_json),track_playcount,popularity)
+    logging.info(f"Loaded candidate pool for {day} | {len(daily_candidate_pool['tracks'])} TRACKS")
+    return daily_candidate_pool
+
+def candidate_pool_track_ids(daily_candidate_pool,item_id,id_type):
+    if id_type == 'track':
+        return [item_id] if item_id in daily_candidate_pool['tracks'] else None
+    return daily_candidate_pool[id_type].get(item_id)
+
+def hydrate_candidate_tracks(conn,sp,ids_related_to_user_for_today,daily_candidate_pool):
+    ids_to_get = {'album':[],'artist':[],'track':[]}
+    for item_id, values in ids_related_to_user_for_today.items():
+        if candidate_pool_track_ids(daily_candidate_pool,item_id,values.id_type) is None:
+            ids_to_get[values.id_type].append(item_id)
+    album_futures = submit_spotify_batches(get_spotify_albums,sp,ids_to_get['album'],20)
+    track_futures = submit_spotify_batches(get_spotify_tracks,sp,ids_to_get['track'],50)
+    artist_futures = {artist_id:spotify_fetch_executor.submit(get_artist_top_tracks,sp,artist_id) for artist_id in dict.fromkeys(ids_to_get['artist'])}
+    albums = {album['id']:album for future in album_futures for album in future.result()}
+    album_track_futures = submit_spotify_batches(get_spotify_tracks,sp,[track['id'] for album in albums.values() for track in album['tracks']['items']],50)
+    hydrated_tracks = {track['id']:track for future in track_futures+album_track_futures for track in future.result()}
+    artist_top_tracks = {artist_id:future.result() for artist_id, future in artist_futures.items()}
+    logging.info(f"HYDRATED | {len(ids_to_get['album'])} ALBUMS | {len(ids_to_get['artist'])} ARTISTS | {len(ids_to_get['track'])} TRACKS | {len(album_futures)+len(track_futures)+len(album_track_futures)} BATCHES")
+    tracks_to_consider, track_playcounts, new_tracks = {}, {}, []
+    for item_id, values in tqdm(ids_related_to_user_for_today.items()):
+        pool_track_ids = candidate_pool_track_ids(daily_candidate_pool,item_id,values.id_type)
+        if pool_track_ids is not None:
+            for track_id in pool_track_ids:
+                if track_id in tracks_to_consider:
+                    continue
+                pool_track = daily_candidate_pool['tracks'][track_id]
+                track_playcounts[track_id] = pool_track['track_playcount']
+                tracks_to_consider = update_tracks_to_consider_with_info(pool_track['track'],values,0,tracks_to_consider,pool_track['popularity'])
+            continue
+        if values.id_type == 'album':
+            tracks = [hydrated_tracks[track['id']] for track in albums[item_id]['tracks']['items'] if track['id'] in hydrated_tracks] if item_id in albums else []
+        elif values.id_type == 'artist':
+            tracks = artist_top_tracks[item_id]
+        ## values.id_type == 'track'
+        else:
+            tracks = [hydrated_tracks[item_id]] if item_id in hydrated_tracks else []
+        for track in tracks:
+            if track['id'] in tracks_to_consider:
+                continue
+            new_tracks.append(track)
+            tracks_to_consider = update_tracks_to_consider_with_info(track,values,0,tracks_to_consider,track.get('popularity',0))
+    with timed_stage('playcounts'):
+        track_playcounts.update(prefetch_track_playcounts(conn,new_tracks))
+    for track_id, values_ in tracks_to_consider.items():
+        values_.track_playcount = track_playcounts.get(track_id,0)
+    return tracks_to_consider
+
+def fetch_user_top_items(sp,time_range):
+    top_items = {'track':[],'artist':[]}
+    for item_type, get_user_top_items in (('track',get_user_top_tracks),('artist',get_user_top_artists)):
+        OFFSET, last_offset = 0, 0
+        with timed_stage(f"top_{item_type}s"):
+            while True:
+                rate_limit('spotify')
+                user_top_items = get_user_top_items(SPOTIFY_GET_LIMIT,time_range,OFFSET,SLEEP_TIMER,sp)
+                top_items[item_type].extend(user_top_items)
+                OFFSET += len(user_top_items)
+                if OFFSET % SPOTIFY_GET_LIMIT != 0 or last_offset == OFFSET:
+                    logging.info(f"{time_range} | FOUND {OFFSET} TOTAL {item_type.upper()}S")
+                    break
+                last_offset = OFFSET
+    return top_items
+
+def snapshot_item(item_type,item):
+    if item_type == 'artist':
+        return item
+    return {'id':item['id'],'name':item['name'],'album':{key:value for key, value in item['album'].items() if key != 'available_markets'}}
+
+def load_user_top_snapshot(conn,spotify_id,time_range):
+    rows = conn.execute("SELECT item_type,item_json,fetched_at FROM user_top_snapshot WHERE spotify_id = ? AND time_range = ? ORDER BY item_type,position",(spotify_id,time_range)).fetchall()
+    if len(rows) == 0:
+        return None
+    snapshot = {'track':[],'artist':[],'fetched_at':min(row[2] for row in rows)}
+    for item_type, item_json, fetched_at in rows:
+        snapshot[item_type].append(json.loads(item_json))
+    return snapshot
+
+def store_user_top_snapshot(conn,spotify_id,time_range,top_items):
+    fetched_at = int(time.time())
+    with conn:
+        conn.execute("DELETE FROM user_top_snapshot WHERE spotify_id = ? AND time_range = ?",(spotify_id,time_range))
+        conn.executemany("INSERT INTO user_top_snapshot (spotify_id,time_range,item_type,position,item_id,item_json,fetched_at) VALUES (?,?,?,?,?,?,?)",
+        ((spotify_id,time_range,item_type,position,item['id'],json.dumps(snapshot_item(item_type,item)),fetched_at) for item_type in ('track','artist') for position, item in enumerate(top_items[item_type])))
+
+def diff_user_top_items(conn,sp,spotify_id,time_range):
+    snapshot = load_user_top_snapshot(conn,spotify_id,time_range)
+    if snapshot is not None and snapshot['fetched_at'] > time.time() - USER_TOP_SNAPSHOT_MAX_AGE_HOURS[time_range]*60*60:
+        logging.info(f"{spotify_id} | {time_range} | SNAPSHOT UNCHANGED | {len(snapshot['track'])} TRACKS | {len(snapshot['artist'])} ARTISTS")
+        return snapshot, set(), False
+    top_items = fetch_user_top_items(sp,time_range)
+    previous_artist_ids = set() if snapshot is None else {artist['id'] for artist in snapshot['artist']}
+    new_artist_ids = {artist['id'] for artist in top_items['artist']} - previous_artist_ids
+    logging.info(f"{spotify_id} | {time_range} | FETCHED TOP ITEMS | {len(top_items['track'])} TRACKS | {len(top_items['artist'])} ARTISTS | {len(new_artist_ids)} NEW ARTISTS")
+    return top_items, new_artist_ids, True
+
+def scan_artist_albums(artist,sp,conn,musicbirthday_values,ids_related_to_user_for_today,albums_already_written,time_range,month_to_match,day_to_match):
+    ALBUM_OFFSET, last_album_offset = 0, 0
+    while True:
+        sub_albums_from_artist = get_artist_top_albums(artist,SPOTIFY_GET_LIMIT,ALBUM_OFFSET,sp)
+        for sub_album in tqdm(sub_albums_from_artist):
+            ALBUM_OFFSET += 1
+            album_id = sub_album['id']
+            ids_related_to_user_for_today = check_if_track_or_album_is_special(None,sub_album,musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS)
+            if album_id not in albums_already_written:
+                albums_already_written = write_album_to_catalog(sub_album,albums_already_written,conn)
+        if ALBUM_OFFSET % SPOTIFY_GET_LIMIT != 0 or last_album_offset == ALBUM_OFFSET:
+            logging.info(f"{time_range} | {artist['id']} | FOUND {ALBUM_OFFSET} TOTAL ALBUMS")
+            break
+        last_album_offset = ALBUM_OFFSET
+    return ids_related_to_user_for_today, albums_already_written
+
+def load_playlist_history(conn):
+    conn.executescript(PLAYLIST_HISTORY_SCHEMA)
+    rows = conn.execute("SELECT spotify_id,music_birthday_spotify_playlist_id,music_birthday_spotify_snapshot_ids FROM user WHERE music_birthday_spotify_snapshot_ids IS NOT NULL AND music_birthday_spotify_playlist_id IS NOT NULL").fetchall()
+    if len(rows) == 0:
+        return
+    with conn:
+        conn.executemany("INSERT INTO playlist_history (spotify_id,playlist_id,track_ids,snapshot_id,details_changed,tracks_changed,published_at) VALUES (?,?,NULL,?,1,1,0)",
+        ((spotify_id,playlist_id,snapshot_id) for spotify_id, playlist_id, snapshot_ids in rows for snapshot_id in snapshot_ids.split('|') if snapshot_id))
+        conn.execute("UPDATE user SET music_birthday_spotify_snapshot_ids = NULL")
+    logging.info(f"MOVED SNAPSHOT IDS OF {len(rows)} USERS INTO playlist_history")
+
+def last_published_playlist(conn,spotify_id,playlist_id):
+    row = conn.execute("SELECT name,description,track_ids,snapshot_id FROM playlist_history WHERE spotify_id = ? AND playlist_id = ? ORDER BY id DESC LIMIT 1",(spotify_id,playlist_id)).fetchone()
+    return None if row is None else {'name':row[0],'description':row[1],'track_ids':json.loads(row[2]) if row[2] is not None else None,'snapshot_id':row[3]}
+
+def record_playlist_publish(conn,spotify_id,playlist_id,day,name,description,track_ids,reasons_in_english_text,snapshot_id,details_changed,tracks_changed):
+    with conn:
+        conn.execute("""INSERT INTO playlist_history (spotify_id,playlist_id,day,name,description,track_ids,reasons,snapshot_id,details_changed,tracks_changed,published_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?)""",(spotify_id,playlist_id,day.strftime('%Y-%m-%d'),name,description,json.dumps(track_ids),reasons_in_english_text,snapshot_id,details_changed,tracks_changed,int(time.time())))
+
+def country_timezone(country):
+    timezone_name = COUNTRY_TIMEZONES.get((country or '').upper())
+    return ZoneInfo(timezone_name) if timezone_name else None
+
+def user_local_date(country,now=None):
+    return datetime.fromtimestamp(now or time.time(),country_timezone(country)).date()
+
+class PlaylistEngine:
+    def __init__(self,sp_oauth=None,seed=PLAYLIST_SHUFFLE_SEED):
+        self.token_manager, self.seed = SpotifyTokenManager(sp_oauth), seed
+        self.musicbirthday_index = self.artists_scanned_this_run = None
+        self.days, self.days_lock = {}, threading.RLock()
+
+    def load_index(self,conn):
+        load_playcount_cache(conn)
+        self.musicbirthday_index = load_musicbirthday_index(conn)
+        load_enrichment_queue(conn)
+        load_email_outbox(conn)
+        load_playlist_history(conn)
+        conn.executescript(USER_TOP_SNAPSHOT_SCHEMA)
+        conn.executescript(METRICS_SCHEMA)
+        self.artists_scanned_this_run = load_artist_scans(conn)
+        self.token_manager.load(conn)
+        return self
+
+    def load_day(self,conn,day,today=None):
+        today = today or datetime.today().date()
+        with self.days_lock:
+            day_state = self.days.get(day)
+            if day_state is None:
+                day_state = self.days[day] = {'day':day,'loaded_on':today,'musicbirthday_values':cached_musicbirthday_values(conn,self.musicbirthday_index,day.month,day.day)[0],'daily_candidate_pool':None}
+            elif day_state['loaded_on'] < day <= today:
+                day_state['musicbirthday_values'], day_state['loaded_on'] = cached_musicbirthday_values(conn,self.musicbirthday_index,day.month,day.day)[0], today
+                logging.info(f"RELOADED {day} NOW THAT IT IS TODAY")
+            return day_state
+
+    def load_days(self,conn,today=None):
+        today = today or datetime.today().date()
+        window = {today + timedelta(days=offset) for offset in range(-MATCH_DAYS_BEFORE,MATCH_DAYS_AFTER+1)}
+        with self.days_lock:
+            if catalog_snapshot_mtime() != self.musicbirthday_index['snapshot_mtime']:
+                logging.info(f"{CATALOG_SNAPSHOT_FILE} CHANGED, RELOADING INDEX")
+                flush_catalog_writes(conn)
+                self.musicbirthday_index = load_musicbirthday_index(conn)
+            for day in [day for day in self.days if day not in window]:
+                del self.days[day]
+                logging.info(f"DROPPED {day} FROM THE MATCH WINDOW")
+            for day in sorted(window):
+                self.load_day(conn,day,today)
+        return self.days
+
+    def load_candidate_pool(self,conn,day,retry=True):
+        with self.days_lock:
+            day_state = self.load_day(conn,day)
+            day_state['daily_candidate_pool'] = load_daily_candidate_pool(conn,day_state['musicbirthday_values'],day.strftime('%Y-%m-%d'),day_state['daily_candidate_pool'],retry)
+            return day_state
+
+    def connect_user(self,conn,spotify_id,refresh_token):
+        sp = self.token_manager.client(spotify_id,refresh_token)
+        return sp, sp.current_user()
+
+    def fetch_user_tops(self,conn,sp,spotify_id,time_range):
+        return diff_user_top_items(conn,sp,spotify_id,time_range)
+
+    def match(self,conn,sp,day_state,time_range,top_items,new_artist_ids,ids_related_to_user_for_today):
+        musicbirthday_values, month_to_match, day_to_match = day_state['musicbirthday_values'], day_state['day'].month, day_state['day'].day
+        artists_already_written, albums_already_written = self.musicbirthday_index['artists_already_written'], self.musicbirthday_index['albums_already_written']
+        for track in top_items['track']:
+            album_id = track['album']['id']
+            ids_related_to_user_for_today = check_if_track_or_album_is_special(track,track['album'],musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS)
+            if album_id not in albums_already_written:
+                albums_already_written = write_album_to_catalog(track['album'],albums_already_written,conn)
+        for artist in tqdm(top_items['artist']):
+            if artist['id'] not in artists_already_written:
+                artists_already_written = write_artist_to_catalog(artist,artists_already_written,conn)
+            else:    
+                ids_related_to_user_for_today = check_if_artist_is_special(artist,musicbirthday_values,ids_related_to_user_for_today,time_range)
+            if artist['id'] in new_artist_ids and claim_id_and_wait(artist['id'],self.artists_scanned_this_run):
+                scanned = False
+                try:
+                    with timed_stage('album_pages'):
+                        ids_related_to_user_for_today, albums_already_written = scan_artist_albums(artist,sp,conn,musicbirthday_values,ids_related_to_user_for_today,albums_already_written,time_range,month_to_match,day_to_match)
+                    self.artists_scanned_this_run.mark_scanned(artist['id'],conn)
+                    scanned = True
+                finally:
+                    release_claimed_id(artist['id'],self.artists_scanned_this_run,scanned)
+            else:
+                flush_catalog_writes(conn)
+                for album_id, release_year in albums_released_on_day_by_artist(conn,artist['id'],month_to_match,day_to_match,self.musicbirthday_index['snapshot']):
+                    if album_id not in ids_related_to_user_for_today:
+                        logging.info(f"{album_id} | {time_range} | {release_year} | ALBUM (cached)")
+                        ids_related_to_user_for_today[album_id] = Match(match_reason(time_range,MatchKind.ARTIST_RELEASE_DATE_TOP_ALBUM),'album',release_year)
+        return ids_related_to_user_for_today
+
+    def hydrate(self,conn,sp,day_state,ids_related_to_user_for_today):
+        with timed_stage('hydration'):
+            tracks_to_consider = hydrate_candidate_tracks(conn,sp,ids_related_to_user_for_today,day_state['daily_candidate_pool'])
+        flush_catalog_writes(conn)
+        self.artists_scanned_this_run.flush(conn)
+        return tracks_to_consider
+
+    def score(self,tracks_to_consider):
+        logging.info("Finished parsing all the stuff, just need to get track scores...")
+        with timed_stage('scoring'):
+            return get_track_scores(tracks_to_consider)
+
+    def select(self,tracks_to_consider):
+        logging.info("...got the scores, determining which tracks to add to playlist...")
+        with timed_stage('selection'):
+            track_ids_to_add_to_playlist, reasons_in_english = get_track_ids_to_add_to_playlist(tracks_to_consider, seed = self.seed)
+        logging.info("...done!")
+        return track_ids_to_add_to_playlist, reasons_in_english
+
+    def publish(self,conn,sp,user_info,playlist_id,track_ids_to_add_to_playlist,reasons_in_english,day):
+        name, description = f"MusicBirthday.com | {day.strftime('%B %d')}", "Your FREE MusicBirthday.com Playlist!"
+        with timed_stage('playlist_write'):
+            if playlist_id is None:
+                logging.info("User doesn't have a playlist, creating...")
+                playlist_id, last_published = sp.user_playlist_create(user=user_info['id'],name=name,public=True,description=description)['id'], None
+                with conn:
+                    conn.execute("UPDATE user SET music_birthday_spotify_playlist_id = ? WHERE spotify_id = ?",(playlist_id,user_info['id']))
+                details_changed = False
+                logging.info("...playlist created successfully.")
+            else:
+                last_published = last_published_playlist(conn,user_info['id'],playlist_id)
+                details_changed = last_published is None or (last_published['name'],last_published['description']) != (name,description)
+                if details_changed:
+                    logging.info(f"Updating playlist name...")
+                    sp.playlist_change_details(playlist_id,name=name,public=True,description=description)
+                else:
+                    count_event('spotify','publish_details_skipped')
+            tracks_changed = last_published is None or last_published['track_ids'] is None or sorted(last_published['track_ids']) != sorted(track_ids_to_add_to_playlist)
+            if tracks_changed:
+                logging.info("Updating playlist with track ids...")
+                snapshot_id = sp.playlist_replace_items(playlist_id, track_ids_to_add_to_playlist)['snapshot_id']
+            else:
+                count_event('spotify','publish_tracks_skipped')
+                track_ids_to_add_to_playlist, snapshot_id = last_published['track_ids'], last_published['snapshot_id']
+            record_playlist_publish(conn,user_info['id'],playlist_id,day,name,description,track_ids_to_add_to_playlist,join_reasons(reasons_in_english,track_ids_to_add_to_playlist),snapshot_id,details_changed,tracks_changed)
+        logging.info(f"PUBLISHED {playlist_id} | {snapshot_id} | DETAILS {'UPDATED' if details_changed else 'UNCHANGED'} | TRACKS {'REPLACED' if tracks_changed else 'UNCHANGED'}")
+        return playlist_id, track_ids_to_add_to_playlist
+
+    def notify(self,conn,user_email,playlist_id,reasons_in_english_text,day):
+        if user_email is None:
+            logging.warning("No e-mail sent (NO EMAIL PROVIDED FROM USER)")
+            return
+        logging.info("Queueing email confirmation to user...")
+        with timed_stage('email'):
+            send_email(conn,user_email,playlist_id,reasons_in_english_text,day)
+        logging.info("...email queued successfully!")
+
+    def generate(self,user_row,publish=True,day=None):
+        spotify_id, refresh_token, user_email, playlist_id = user_row
+        start_user_metrics()
+        try:
+            with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+                day_state = self.load_candidate_pool(conn,day or datetime.today().date(),retry=False)
+                sp, user_info = self.connect_user(conn,spotify_id,refresh_token)
+                logging.info(f"Starting playlist generation for '{spotify_id}' ({user_email}) | {day_state['day']}")
+                ids_related_to_user_for_today, fetched_top_items = {}, {}
+                for time_range in ('short','medium','long'):
+                    top_items, new_artist_ids, fetched = self.fetch_user_tops(conn,sp,spotify_id,time_range)
+                    ids_related_to_user_for_today = self.match(conn,sp,day_state,time_range,top_items,new_artist_ids,ids_related_to_user_for_today)
+                    if fetched:
+                        fetched_top_items[time_range] = top_items
+                for time_range, top_items in fetched_top_items.items():
+                    store_user_top_snapshot(conn,spotify_id,time_range,top_items)
+                    logging.info(f"{spotify_id} | {time_range} | SNAPSHOT UPDATED | {len(top_items['track'])} TRACKS | {len(top_items['artist'])} ARTISTS")
+                tracks_to_consider = self.score(self.hydrate(conn,sp,day_state,ids_related_to_user_for_today))
+                track_ids_to_add_to_playlist, reasons_in_english = self.select(tracks_to_consider)
+                if not publish:
+                    logging.info(f"DRY RUN | {spotify_id} | {len(track_ids_to_add_to_playlist)} TRACKS | NOT PUBLISHED")
+                    return track_ids_to_add_to_playlist, join_reasons(reasons_in_english,track_ids_to_add_to_playlist)
+                playlist_id, track_ids_to_add_to_playlist = self.publish(conn,sp,user_info,playlist_id,track_ids_to_add_to_playlist,reasons_in_english,day_state['day'])
+                reasons_in_english_text = join_reasons(reasons_in_english,track_ids_to_add_to_playlist)
+                self.notify(conn,user_email,playlist_id,reasons_in_english_text,day_state['day'])
+                return track_ids_to_add_to_playlist, reasons_in_english_text
+        except Exception as ee:
+            logging.critical(f"{spotify_id} | {user_email} | {ee}")
+        finally:
+            finish_user_metrics(spotify_id)
+
+    def user_row(self,conn,spotify_id):
+        user_row = conn.execute("SELECT spotify_id,refresh_token,email,music_birthday_spotify_playlist_id,country FROM user WHERE spotify_id = ?",(spotify_id,)).fetchone()
+        if user_row is None:
+            logging.error(f"{spotify_id} | NO SUCH USER")
+            return None, None
+        return user_row[:4], user_local_date(user_row[4])
+
+    def run_user(self,spotify_id,publish=True):
+        with sqlite3.connect('musicbirthday.db') as conn:
+            user_row, day = self.user_row(conn,spotify_id)
+            if user_row is None:
+                return None
+            self.load_candidate_pool(conn,day)
+            self.token_manager.refresh_expiring(conn,[user_row])
+        start_run_metrics()
+        result = self.generate(user_row,publish,day)
+        with sqlite3.connect('musicbirthday.db') as conn:
+            self.token_manager.flush(conn)
+            finish_run_metrics(conn)
+        return result
+
+    def profile_user(self,spotify_id):
+        with sqlite3.connect('musicbirthday.db') as conn:
+            user_row, day = self.user_row(conn,spotify_id)
+            if user_row is None:
+                return
+            self.load_candidate_pool(conn,day)
+            self.token_manager.refresh_expiring(conn,[user_row])
+        start_run_metrics()
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        self.generate(user_row,True,day)
+        profiler.disable()
+        memory_snapshot, memory_peak = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profiler.dump_stats(f"profile_{spotify_id}.prof")
+        print("cProfile only covers the main thread: Spotify hydration, Last.fm prefetch and HTTP requests run on worker threads, see the METRICS stage: lines for their wall time")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        for memory_stat in memory_snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+            print(memory_stat)
+        logging.info(f"PROFILED {spotify_id} | PEAK MEMORY {round(memory_peak/1024/1024,1)} MB | STATS IN profile_{spotify_id}.prof")
+
+    def run_daemon(self,workers=1,skip_first_loop=True,mode=SCHEDULE_MODE,window_hours=SCHEDULE_WINDOW_HOURS):
+        UserScheduler(self,workers,mode,window_hours).run_forever(skip_first_loop)
+
+class UserScheduler:
+    def __init__(self,engine,workers=1,mode=SCHEDULE_MODE,window_hours=SCHEDULE_WINDOW_HOURS):
+        self.engine, self.workers, self.mode, self.window_seconds = engine, workers, mode, window_hours*60*60
+        self.due_heap, self.due_at, self.countries = [], {}, {}
+        self.data_version, self.compacted_day = None, None
+
+    def user_timezone(self,spotify_id):
+        return country_timezone(self.countries.get(spotify_id)) if self.mode == 'local-midnight' else None
+
+    def next_due_at(self,spotify_id,after):
+        zone, local_date = self.user_timezone(spotify_id), datetime.fromtimestamp(after,self.user_timezone(spotify_id)).date()
+        offset = 0 if self.mode == 'local-midnight' else int(hashlib.md5(spotify_id.encode('utf-8')).hexdigest()[:8],16) % max(self.window_seconds,1)
+        while True:
+            due_at = datetime(local_date.year,local_date.month,local_date.day,*SCHEDULE_RUN_TIME,tzinfo=zone).timestamp() + offset
+            if due_at > after:
+                return int(due_at)
+            local_date += timedelta(days=1)
+
+    def push(self,spotify_id,due_at):
+        self.due_at[spotify_id] = due_at
+        heapq.heappush(self.due_heap,(due_at,spotify_id))
+
+    def schedule(self,conn,spotify_id,due_at,last_run_at=None):
+        self.push(spotify_id,due_at)
+        with conn:
+            conn.execute("""INSERT INTO user_schedule (spotify_id,next_run_at,last_run_at) VALUES (?,?,?)
+            ON CONFLICT(spotify_id) DO UPDATE SET next_run_at = excluded.next_run_at,last_run_at = coalesce(excluded.last_run_at,last_run_at)""",(spotify_id,due_at,last_run_at))
+
+    def load(self,conn,skip_first_loop=True):
+        conn.executescript(SCHEDULE_SCHEMA)
+        with conn:
+            conn.execute("DELETE FROM signup_queue")
+            conn.execute("DELETE FROM user_schedule WHERE spotify_id NOT IN (SELECT spotify_id FROM user)")
+        now, resumed, new_schedules = int(time.time()), 0, []
+        for spotify_id, country, next_run_at in conn.execute("SELECT user.spotify_id,user.country,user_schedule.next_run_at FROM user LEFT JOIN user_schedule ON user_schedule.spotify_id = user.spotify_id").fetchall():
+            self.countries[spotify_id] = country
+            if next_run_at is None:
+                next_run_at = self.next_due_at(spotify_id,now) if skip_first_loop else now
+                new_schedules.append((spotify_id,next_run_at))
+            resumed += next_run_at <= now
+            self.push(spotify_id,next_run_at)
+        with conn:
+            conn.executemany("INSERT INTO user_schedule (spotify_id,next_run_at) VALUES (?,?)",new_schedules)
+        self.data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        logging.info(f"SCHEDULED {len(self.due_at)} USERS | {len(new_schedules)} NEW | {resumed} DUE NOW | MODE {self.mode.upper()}")
+
+    def check_signups(self,conn):
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        signups = conn.execute("SELECT signup_queue.id,user.spotify_id,user.country FROM signup_queue JOIN user ON user.spotify_id = signup_queue.spotify_id").fetchall()
+        with conn:
+            conn.execute("DELETE FROM signup_queue WHERE id <= ?",(max([signup[0] for signup in signups],default=0),))
+        for signup_id, spotify_id, country in signups:
+            self.countries[spotify_id] = country
+            if spotify_id not in self.due_at:
+                logging.info(f"NEW SIGNUP | {spotify_id} | SCHEDULED NOW")
+                self.schedule(conn,spotify_id,int(time.time()))
+
+    def pop_due_users(self,now):
+        due_users = []
+        while self.due_heap and self.due_heap[0][0] <= now:
+            due_at, spotify_id = heapq.heappop(self.due_heap)
+            if self.due_at.get(spotify_id) == due_at:
+                del self.due_at[spotify_id]
+                due_users.append(spotify_id)
+        return due_users
+
+    def submit_due_users(self,conn,executor,due_users):
+        if len(due_users) == 0:
+            return {}
+        users_by_day = {}
+        for spotify_id in due_users:
+            users_by_day.setdefault(user_local_date(self.countries.get(spotify_id)),[]).append(spotify_id)
+        user_rows = {user_row[0]:user_row for user_row in conn.execute(f"SELECT spotify_id,refresh_token,email,music_birthday_spotify_playlist_id FROM user WHERE spotify_id IN ({','.join('?'*len(due_users))})",due_users)}
+        for spotify_id in set(due_users) - set(user_rows):
+            logging.warning(f"{spotify_id} | USER GONE, UNSCHEDULING")
+            with conn:
+                conn.execute("DELETE FROM user_schedule WHERE spotify_id = ?",(spotify_id,))
+        for day, spotify_ids in sorted(users_by_day.items()):
+            self.engine.load_candidate_pool(conn,day)
+            logging.info(f"{len([spotify_id for spotify_id in spotify_ids if spotify_id in user_rows])} users due for {day}")
+        self.engine.token_manager.refresh_expiring(conn,list(user_rows.values()))
+        logging.info(f"Updating {len(user_rows)} users with {self.workers} workers")
+        return {executor.submit(self.engine.generate,user_rows[spotify_id],True,day):spotify_id for day, spotify_ids in sorted(users_by_day.items()) for spotify_id in spotify_ids if spotify_id in user_rows}
+
+    def run_due_users(self,conn):
+        due_users = self.pop_due_users(time.time())
+        if len(due_users) == 0:
+            return
+        start_run_metrics()
+        self.engine.load_days(conn)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = self.submit_due_users(conn,executor,due_users)
+            while futures:
+                done, _ = wait(futures,timeout=SIGNUP_CHECK_SECONDS,return_when=FIRST_COMPLETED)
+                for future in done:
+                    spotify_id, finished_at = futures.pop(future), int(time.time())
+                    self.schedule(conn,spotify_id,self.next_due_at(spotify_id,finished_at),finished_at)
+                self.check_signups(conn)
+                futures.update(self.submit_due_users(conn,executor,self.pop_due_users(time.time())))
+        self.engine.token_manager.flush(conn)
+        finish_run_metrics(conn)
+        log_spotify_cache_stats()
+
+    def run_forever(self,skip_first_loop=True):
+        with sqlite3.connect('musicbirthday.db',timeout=30) as conn:
+            self.load(conn,skip_first_loop)
+            while True:
+                self.check_signups(conn)
+                if self.compacted_day != datetime.today().date():
+                    self.compacted_day = datetime.today().date()
+                    self.engine.artists_scanned_this_run.compact(conn)
+                self.run_due_users(conn)
+                sleep_seconds = SIGNUP_CHECK_SECONDS if not self.due_heap else min(SIGNUP_CHECK_SECONDS,max(self.due_heap[0][0] - time.time(),0))
+                time.sleep(sleep_seconds)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("-s",type=str, help="Skip Users on First Go (default = Yes",default='y')
+    parser.add_argument("-s",type=str, help="Skip Users on First Go, run-daemon only (default = Yes",default='y')
+    parser.add_argument("-w",type=int, help="Number of users to update at the same time, run-daemon only (default = 1)",default=1)
+    parser.add_argument("-e",type=int, help="Number of background artist enrichment workers (default = 2)",default=2)
+    parser.add_argument("--seed",type=int, help="Seed for shuffling playlists, for reproducible runs (default = random)",default=None)
+    parser.add_argument("--schedule",type=str, choices=['local-midnight','window'], help="Run each user at their country's local midnight, or spread everyone over --window-hours from 00:01 (default = local-midnight)",default=SCHEDULE_MODE)
+    parser.add_argument("--window-hours",type=int, help="Hours to spread the nightly run over with --schedule window (default = 6)",default=SCHEDULE_WINDOW_HOURS)
+    parser.add_argument("--metrics-port",type=int, help="Serve Prometheus metrics on this local port (default = off)",default=None)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run-daemon', help="Update every user's playlist, then keep checking for new users and new days (default)")
+    run_user_parser = subparsers.add_parser('run-user', help="Generate and publish one user's playlist, then exit")
+    run_user_parser.add_argument("spotify_id",type=str)
+    run_user_parser.add_argument("--profile",action='store_true', help="Profile the run with cProfile and tracemalloc")
+    subparsers.add_parser('build-index', help="Import the catalog and build today's candidate pool, then exit")
+    subparsers.add_parser('build-snapshot', help="Compile the catalog into a memory-mapped snapshot that the daemon opens at startup, then exit")
+    dry_run_parser = subparsers.add_parser('dry-run', help="Generate one user's playlist and print it without publishing or emailing")
+    dry_run_parser.add_argument("spotify_id",type=str)
     args = parser.parse_args()
-    skip_first_loop = (args.s == 'y')
     configure_logging()
-    cached_playcounts = get_cached_playcounts()
-    artists_scanned_this_run = recently_scanned_()
-    user_ids_updated_today = set()
-    sp_oauth = spotify_oauth_1()
-    target_time = (datetime.now()).replace(hour=0, minute=1, second=0, microsecond=0)
-    while True:
-        musicbirthday_values, artists_already_written, albums_already_written = cached_musicbirthday_values()
-        month_to_match, day_to_match = datetime.today().month, datetime.today().day
+    engine = PlaylistEngine(seed=args.seed)
+    with sqlite3.connect('musicbirthday.db') as conn:
+        engine.load_index(conn)
+        if args.command == 'build-index':
+            engine.load_days(conn)
+            engine.load_candidate_pool(conn,datetime.today().date())
+            sys.exit(0)
+        if args.command == 'build-snapshot':
+            build_catalog_snapshot(conn)
+            sys.exit(0)
+    start_enrichment_workers(args.e)
+    if args.command != 'dry-run':
+        start_email_sender()
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+    engine.token_manager.sp_oauth = spotify_oauth_1()
+    if args.command == 'run-user' and args.profile:
+        engine.profile_user(args.spotify_id)
+    elif args.command == 'run-user':
+        engine.run_user(args.spotify_id)
         with sqlite3.connect('musicbirthday.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute("""SELECT count (distinct spotify_id) FROM user""")
-            current_user_count = last_user_count = cursor.fetchall()[0][0]
-            if datetime.now() >= target_time or current_user_count > len(user_ids_updated_today):
-                if current_user_count==last_user_count:
-                    target_time = (datetime.now()+timedelta(days=1)).replace(hour=0, minute=1, second=0, microsecond=0)
-                    logging.info("Updating all users' playlists")
-                    del user_ids_updated_today
-                    user_ids_updated_today = set()
-                cursor.execute("SELECT spotify_id,refresh_token,email,music_birthday_spotify_playlist_id FROM user")
-                for spotify_id, refresh_token, user_email, playlist_id in cursor.fetchall():
-                    try:
-                        if spotify_id in user_ids_updated_today:
-                            logging.warning(f"Skipping '{spotify_id}' ({user_email}) because already parsed")
-                            continue
-                        user_ids_updated_today.add(spotify_id)
-                        if skip_first_loop:
-                            logging.warning(f"Skipping '{spotify_id}' ({user_email}) because SKIP FIRST LOOP is enabled")
-                            continue
-                        logging.info("Refreshing access token")
-                        sp, access_token = define_spotify_objects(sp_oauth, refresh_token)
-                        user_info = sp.current_user()
-                        cursor.execute("UPDATE user SET access_token = ? WHERE refresh_token = ?", (access_token, refresh_token))
-                        conn.commit()
-                        logging.info(f"Starting playlist generation for '{spotify_id}' ({user_email})")
-                        ids_related_to_user_for_today = {}
-                        for time_range in ('short','medium','long'):
-                            TRACK_OFFSET, last_track_offset = 0, 0
-                            while True:
-                                time.sleep(SLEEP_TIMER)
-                                user_top_tracks = get_user_top_tracks(SPOTIFY_GET_LIMIT,time_range,TRACK_OFFSET,SLEEP_TIMER,sp)
-                                for track in user_top_tracks:
-                                    TRACK_OFFSET += 1
-                                    album_row,album_id = generate_album_row(track['album'])
-                                    ids_related_to_user_for_today = check_if_track_or_album_is_special(track,album_row,musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS)
-                                    if album_id not in albums_already_written:
-                                        albums_already_written = write_album_id_to_csv(album_row,albums_already_written)
-                                if TRACK_OFFSET % SPOTIFY_GET_LIMIT != 0 or last_track_offset == TRACK_OFFSET:
-                                    logging.info(f"{time_range} | FOUND {TRACK_OFFSET} TOTAL TRACKS")
-                                    break
-                                last_track_offset = TRACK_OFFSET
-                            ARTIST_OFFSET, last_artist_offset = 0, 0
-                            while True:
-                                time.sleep(SLEEP_TIMER)
-                                user_top_artists = get_user_top_artists(SPOTIFY_GET_LIMIT,time_range,ARTIST_OFFSET,SLEEP_TIMER,sp)
-                                for artist in tqdm(user_top_artists):
-                                    ARTIST_OFFSET += 1
-                                    if artist['id'] not in artists_already_written:
-                                        albums_already_written, ids_related_to_user_for_today = write_artist_id_to_csv(artist,artists_already_written,month_to_match, day_to_match,ids_related_to_user_for_today)
-                                    else:    
-                                        ids_related_to_user_for_today = check_if_artist_is_special(artist,musicbirthday_values,ids_related_to_user_for_today,time_range)
-                                    if artist['id'] not in artists_scanned_this_run:
-                                        ALBUM_OFFSET, last_album_offset = 0, 0
-                                        while True:
-                                            time.sleep(SLEEP_TIMER)
-                                            sub_albums_from_artist = get_artist_top_albums(artist,SPOTIFY_GET_LIMIT,ALBUM_OFFSET)
-                                            for sub_album in tqdm(sub_albums_from_artist):
-                                                ALBUM_OFFSET += 1
-                                                album_row, album_id = generate_album_row(sub_album)
-                                                ids_related_to_user_for_today = check_if_track_or_album_is_special(None,album_row,musicbirthday_values,ids_related_to_user_for_today,time_range,MOST_RECENT_YEAR,month_to_match,day_to_match,SKIP_KEYWORDS)
-                                                if album_id not in albums_already_written:
-                                                    albums_already_written = write_album_id_to_csv(album_row,albums_already_written)
-                                            if ALBUM_OFFSET % SPOTIFY_GET_LIMIT != 0 or last_album_offset == ALBUM_OFFSET:
-                                                logging.info(f"{time_range} | {artist['id']} | FOUND {ALBUM_OFFSET} TOTAL ALBUMS")
-                                                break
-                                            last_album_offset = ALBUM_OFFSET
-                                        artists_scanned_this_run.add(artist['id'])
-                                        with open('artists_recently_scanned.csv','a+',encoding='utf-8',newline='') as outfile:
-                                            writer = csv.writer(outfile,delimiter=',')
-                                            writer.writerow([artist['id'],datetime.now().strftime('%m/%d/%Y')])
-                                    else:
-                                        for album_id in musicbirthday_values['release_date']:
-                                            if album_id not in ids_related_to_user_for_today and artist['id'] in musicbirthday_values['release_date'][album_id]['artist_ids']:
-                                                logging.info(f"{album_id} | {time_range} | {musicbirthday_values['release_date'][album_id]['date']} | ALBUM (cached)")
-                                                ids_related_to_user_for_today[album_id] = {'type':time_range+'_artist_release_date_top_album','id_type':'album','id':album_id,'year':musicbirthday_values['release_date'][album_id]['date'].year}
-                                if ARTIST_OFFSET % SPOTIFY_GET_LIMIT != 0 or last_artist_offset == ARTIST_OFFSET:
-                                    logging.info(f"{time_range} | FOUND {ARTIST_OFFSET} TOTAL ARTISTS")
-                                    break
-                                last_artist_offset = ARTIST_OFFSET
-                        album_ids_to_get, track_ids_to_get, tracks_to_consider = [], [], {}
-                        for spotify_id, values in tqdm(ids_related_to_user_for_today.items()):
-                            if values['id_type'] == 'album':
-                                album_ids_to_get.append(spotify_id)
-                                if len(album_ids_to_get)==20:
-                                    for album in sp.albums(album_ids_to_get)['albums']:
-                                        for track in album['tracks']['items']:
-                                            if track['id'] in tracks_to_consider:
-                                                continue
-                                            try:
-                                                track_playcount = cached_playcounts[track['id']]
-                                                logging.info(f"CACHED TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                            except Exception as e:
-                                                track_playcount = 0
-                                                for track_artist in track['artists']:
-                                                    track_playcount = get_track_playcount(track_playcount,track_artist,track)
-                                                    time.sleep(SLEEP_TIMER)
-                                                with open('track_playcounts.tsv','a+',encoding='utf-8',newline='') as outfile:
-                                                    outfile.write(track['id']+'\t'+str(track_playcount)+'\n')
-                                                    outfile.flush()
-                                                    cached_playcounts[track['id']] = track_playcount
-                                                    logging.info(f"NEW TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                            tracks_to_consider = update_tracks_to_consider_with_info(track,values,track_playcount,dict(),tracks_to_consider)
-                                    del album_ids_to_get
-                                    album_ids_to_get = []
-                            elif values['id_type'] == 'artist':
-                                for track in sp.artist_top_tracks(spotify_id, country='US')['tracks']:
-                                    if track['id'] in tracks_to_consider:
-                                        continue
-                                    track_playcount = 0
-                                    try:
-                                        track_playcount = cached_playcounts[track['id']]
-                                        logging.info(f"CACHED TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                    except Exception as e:
-                                        track_playcount = 0
-                                        for track_artist in track['artists']:
-                                            track_playcount = get_track_playcount(track_playcount,track_artist,track)
-                                            time.sleep(SLEEP_TIMER)
-                                        with open('track_playcounts.tsv','a+',encoding='utf-8',newline='') as outfile:
-                                            outfile.write(track['id']+'\t'+str(track_playcount)+'\n')
-                                            outfile.flush()
-                                            cached_playcounts[track['id']] = track_playcount
-                                            logging.info(f"NEW TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                    tracks_to_consider = update_tracks_to_consider_with_info(track,values,track_playcount,dict(),tracks_to_consider)
-                            ## values['id_type'] == 'track'
-                            else:
-                                track_ids_to_get.append(spotify_id)
-                                if len(track_ids_to_get)==50:
-                                    for track in sp.tracks(track_ids_to_get,'US')['tracks']:
-                                        if track['id'] in tracks_to_consider:
-                                            continue
-                                        try:
-                                            track_playcount = cached_playcounts[track['id']]
-                                            logging.info(f"CACHED TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                        except Exception as e:
-                                            track_playcount = 0
-                                            for track_artist in track['artists']:
-                                                track_playcount = get_track_playcount(track_playcount,track_artist,track)
-                                                time.sleep(SLEEP_TIMER)
-                                            with open('track_playcounts.tsv','a+',encoding='utf-8',newline='') as outfile:
-                                                outfile.write(track['id']+'\t'+str(track_playcount)+'\n')
-                                                outfile.flush()
-                                                cached_playcounts[track['id']] = track_playcount
-                                                logging.info(f"NEW TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                        tracks_to_consider = update_tracks_to_consider_with_info(track,values,track_playcount,dict(),tracks_to_consider)
-                        if len(album_ids_to_get)>0:
-                            for album in sp.albums(album_ids_to_get)['albums']:
-                                for track in album['tracks']['items']:
-                                    if track['id'] in tracks_to_consider:
-                                        continue
-                                    try:
-                                        track_playcount = cached_playcounts[track['id']]
-                                        logging.info(f"CACHED TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                    except:
-                                        track_playcount = 0
-                                        for track_artist in track['artists']:
-                                            track_playcount = get_track_playcount(track_playcount,track_artist,track)
-                                            time.sleep(SLEEP_TIMER)
-                                        with open('track_playcounts.tsv','a+',encoding='utf-8',newline='') as outfile:
-                                            outfile.write(track['id']+'\t'+str(track_playcount)+'\n')
-                                            outfile.flush()
-                                            cached_playcounts[track['id']] = track_playcount
-                                            logging.info(f"NEW TRACK COUNT FOUND | {track['name']} | {track_playcount}")
-                                    tracks_to_consider = update_tracks_to_consider_with_info(track,values,track_playcount,dict(),tracks_to_consider)
-                        if len(track_ids_to_get)>0:
-                            for track in sp.tracks(track_ids_to_get,'US')['tracks']:
-                                if track['id'] in tracks_to_consider:
-                                    continue
-                                try:
-                                    track_playcount = cached_playcounts[track['id']]
-                                except:
-                                    track_playcount = 0
-                                    for track_artist in track['artists']:
-                                        track_playcount = get_track_playcount(track_playcount,track_artist,track)
-                                        time.sleep(SLEEP_TIMER)
-                                    with open('track_playcounts.tsv','a+',encoding='utf-8',newline='') as outfile:
-                                        outfile.write(track['id']+'\t'+str(track_playcount)+'\n')
-                                        outfile.flush()
-                                        cached_playcounts[track['id']] = track_playcount
-                                tracks_to_consider = update_tracks_to_consider_with_info(track,values,track_playcount,dict(),tracks_to_consider)
-                        logging.info("Finished parsing all the stuff, just need to get track scores...")
-                        tracks_to_consider = get_track_scores(tracks_to_consider)
-                        logging.info("...got the scores, determining which tracks to add to playlist...")
-                        track_ids_to_add_to_playlist, reasons_in_english_text = get_track_ids_to_add_to_playlist(tracks_to_consider, sp)
-                        logging.info("...done!")
-                        if playlist_id is None:
-                            logging.info("User doesn't have a playlist, creating...")
-                            new_playlist = sp.user_playlist_create(user=user_info['id'],name=f"MusicBirthday.com | {datetime.today().strftime('%B %d')}",public=True,description=None)
-                            playlist_id = new_playlist['id']
-                            logging.info("...playlist created successfully.")
-                        logging.info(f"Updating playlist name...")
-                        sp.playlist_change_details(playlist_id,name=f"MusicBirthday.com | {datetime.today().strftime('%B %d')}",public=True,description="Your FREE MusicBirthday.com Playlist!")
-                        logging.info("...updated, updating playlist with track ids...")
-                        sp.playlist_replace_items(playlist_id, track_ids_to_add_to_playlist)
-                        logging.info("...updated. Getting current snapshot id...")
-                        current_snapshot_id = sp.playlist(playlist_id)['snapshot_id']
-                        logging.info("...retrieved, updating database...")
-                        cursor.execute("""UPDATE user SET music_birthday_spotify_playlist_id = ?,music_birthday_spotify_snapshot_ids = (music_birthday_spotify_snapshot_ids || '|' || ?)
-                        WHERE spotify_id = ?""",(playlist_id,current_snapshot_id, user_info['id']))
-                        conn.commit()
-                        logging.info("...updated successfully!")
-                        if user_email is None:
-                            logging.warning("No e-mail sent (NO EMAIL PROVIDED FROM USER)")
-                            continue
-                        logging.info("Sending email confirmation to user...")
-                        send_email(user_email,playlist_id,reasons_in_english_text)
-                        logging.info("...email sent successfully!")
-                    except Exception as ee:
-                        logging.critical(f"{spotify_id} | {user_email} | {ee}")
-        sleep_minutes = 15
-        logging.info(f"Finished processing users, waiting for {sleep_minutes} minutes until trying again...{target_time}")
-        time.sleep(60*sleep_minutes)
-        skip_first_loop = False
\ No newline at end of file
+            wait_for_email_outbox(conn)
+    elif args.command == 'dry-run':
+        result = engine.run_user(args.spotify_id,publish=False)
+        if result is not None:
+            print('\n'.join(result[0]))
+            print(result[1])
+    else:
+        engine.run_daemon(args.w,args.s == 'y',args.schedule,args.window_hours)
\ No newline at end of file